@@ -0,0 +1,388 @@
+"""
+Offline benchmarks of the pipeline stages.
+
+The models are tiny randomly initialized stand-ins with the same architecture as
+the real ones, so this runs without network and measures the code around them
+(chunking, trellis, timing...) rather than the weights. Each case runs in a fresh
+process so that its peak RSS is its own.
+
+    uv run --all-extras python benchmarks/bench.py -o results.json
+    uv run --all-extras python benchmarks/compare.py baseline.json results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import cached_property
+from itertools import cycle, islice, pairwise
+from pathlib import Path
+from typing import Any
+
+import pysubs2
+import torch
+from torchaudio.functional import TokenSpan
+from torchaudio.models import HDemucs, wav2vec2_model
+from transformers import (
+    Wav2Vec2Config,
+    Wav2Vec2CTCTokenizer,
+    Wav2Vec2FeatureExtractor,
+    Wav2Vec2ForCTC,
+    Wav2Vec2Processor,
+)
+from transformers import (
+    logging as transformers_logging,
+)
+
+from yohane.alignment import ForcedAlignment
+from yohane.audio import (
+    ForcedAligner,
+    HybridDemucsSeparator,
+    TorchAudioForcedAligner,
+    Wav2Vec2ForcedAligner,
+)
+from yohane.lyrics import Lyrics, auto_split, normalize_uroman
+from yohane.profiling import Profiler
+from yohane.resampling import resample
+from yohane.subtitles import make_ass, read_timed_lines
+from yohane.tokens import TokenPlan
+
+SAMPLES_DIR = Path(__file__).parent.parent / "samples"
+SEED = 0
+
+
+class TinyHybridDemucsSeparator(HybridDemucsSeparator):
+    @cached_property
+    def model(self) -> torch.nn.Module:
+        torch.manual_seed(SEED)
+        model = HDemucs(["drums", "bass", "other", "vocals"], channels=4).eval()
+        model.to(self.device)
+        return model
+
+
+class _LogSoftmax(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None):
+        emission, lengths = self.model(waveforms, lengths)
+        return torch.log_softmax(emission, dim=-1), lengths
+
+
+class TinyTorchAudioForcedAligner(TorchAudioForcedAligner):
+    def __init__(self, **kwargs) -> None:
+        ForcedAligner.__init__(self, **kwargs)
+        torch.manual_seed(SEED)
+        params = dict(self.bundle._params)
+        params.update(
+            extractor_conv_layer_config=[
+                (32, kernel, stride)
+                for _, kernel, stride in params["extractor_conv_layer_config"]
+            ],
+            encoder_embed_dim=64,
+            encoder_pos_conv_kernel=16,
+            encoder_pos_conv_groups=4,
+            encoder_num_layers=1,
+            encoder_num_heads=2,
+            encoder_ff_interm_features=128,
+        )
+        self.tokenizer = self.bundle.get_tokenizer()
+        self.model = _LogSoftmax(wav2vec2_model(**params)).eval()
+        self.device = torch.device("cpu")
+        self.aligner = self.bundle.get_aligner()
+
+
+def save_tiny_wav2vec2(path: Path):
+    """Save a tiny Wav2Vec2ForCTC and its processor to be loaded by Wav2Vec2ForcedAligner"""
+    vocab = ["<pad>", "<s>", "</s>", "<unk>", "|", *"abcdefghijklmnopqrstuvwxyz'"]
+    vocab_file = path / "vocab.json"
+    vocab_file.write_text(json.dumps({token: i for i, token in enumerate(vocab)}))
+    tokenizer = Wav2Vec2CTCTokenizer(vocab_file.as_posix())
+    feature_extractor = Wav2Vec2FeatureExtractor(do_normalize=True)
+    Wav2Vec2Processor(feature_extractor, tokenizer).save_pretrained(path)
+    torch.manual_seed(SEED)
+    config = Wav2Vec2Config(
+        vocab_size=len(vocab),
+        pad_token_id=0,
+        hidden_size=64,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=128,
+        conv_dim=(32,) * 7,
+        num_conv_pos_embeddings=16,
+        num_conv_pos_embedding_groups=4,
+    )
+    Wav2Vec2ForCTC(config).eval().save_pretrained(path)
+
+
+def make_aligner(name: str, chunk_length: float | None) -> ForcedAligner:
+    transformers_logging.disable_progress_bar()
+    if name == "torchaudio":
+        return TinyTorchAudioForcedAligner(chunk_length=chunk_length)
+    model_dir = Path(tempfile.mkdtemp(prefix="yohane-bench-"))
+    save_tiny_wav2vec2(model_dir)
+    aligner = Wav2Vec2ForcedAligner(model_dir.as_posix(), chunk_length=chunk_length)
+    aligner.device = torch.device("cpu")
+    aligner.model.to(aligner.device)  # pyright: ignore[reportArgumentType]
+    return aligner
+
+
+def make_song(duration: float, sample_rate=44100):
+    """Stereo harmonic 'singing' over noise, with pauses every few seconds"""
+    generator = torch.Generator().manual_seed(SEED)
+    t = torch.arange(int(duration * sample_rate)) / sample_rate
+    pitch = 220 * 2 ** (torch.floor(t * 2) % 12 / 12)  # a new note every 0.5s
+    phase = 2 * torch.pi * torch.cumsum(pitch, 0) / sample_rate
+    voice = sum(torch.sin(k * phase) / k for k in range(1, 6))
+    voice = voice * ((t % 8) < 6)  # 2s pause every 8s
+    noise = torch.randn(2, t.size(0), generator=generator) * 0.05
+    return (0.3 * voice + noise).float(), sample_rate
+
+
+def make_lyrics(duration: float):
+    """Cycle over the lines of the samples to match their density"""
+    lines: list[str] = []
+    lines_per_second: list[float] = []
+    for sample in sorted(SAMPLES_DIR.glob("*.ass")):
+        timed_lines = read_timed_lines(pysubs2.load(sample.as_posix()))
+        lines.extend(comment.text for comment, _ in timed_lines)
+        span = (timed_lines[-1][1].end - timed_lines[0][1].start) / 1000
+        lines_per_second.append(len(timed_lines) / span)
+    nb_lines = max(1, round(duration * statistics.mean(lines_per_second)))
+    return Lyrics("\n".join(islice(cycle(lines), nb_lines)))
+
+
+def even_token_spans(token_plan: TokenPlan, num_frames: int):
+    """Spread the tokens evenly over the frames, to time without aligning"""
+    nb_tokens = token_plan.token_ids.size(0)
+    step = num_frames / nb_tokens
+    spans = [
+        TokenSpan(token, int(i * step), int((i + 1) * step), 1.0)
+        for i, token in enumerate(token_plan.token_ids.tolist())
+    ]
+    offsets = token_plan.word_offsets.tolist()
+    return [spans[start:end] for start, end in pairwise(offsets)]
+
+
+@dataclass
+class Case:
+    stage: str
+    params: dict[str, Any]
+
+    @property
+    def name(self):
+        params = ", ".join(f"{k}={v}" for k, v in self.params.items())
+        return f"{self.stage}({params})"
+
+
+@dataclass
+class Result:
+    stage: str
+    params: dict[str, Any]
+    runs: list[float]  # s
+    cpu_time: float  # s, median
+    peak_rss: int | None  # bytes
+    work: float  # amount of work per run
+    unit: str  # of the work
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def median(self):
+        return statistics.median(self.runs)
+
+    @property
+    def throughput(self):
+        return self.work / self.median
+
+    def to_json(self):
+        return {
+            **asdict(self),
+            "median": self.median,
+            "throughput": self.throughput,
+        }
+
+
+def prepare(case: Case) -> tuple[Callable[[], Any], float, str, dict[str, Any]]:
+    """Build the inputs of the case outside of the measurements"""
+    params = case.params
+    duration = params.get("duration", 0)
+
+    if case.stage == "demucs":
+        separator = TinyHybridDemucsSeparator(batch_size=params["batch_size"])
+        song = make_song(duration)
+        mix = song[0][None]
+        _ = separator.model
+        return lambda: separator.separate_sources(mix, song[1]), duration, "s", {}
+
+    if case.stage in ("emission", "trellis"):
+        aligner = make_aligner(params["aligner"], params["chunk_length"])
+        waveform, sample_rate = make_song(duration)
+        waveform = resample(
+            waveform.mean(0, keepdim=True), sample_rate, aligner.sample_rate
+        )
+        if case.stage == "emission":
+            return (
+                lambda: aligner.emission(waveform, aligner.sample_rate),
+                duration,
+                "s",
+                {},
+            )
+        emission = aligner.emission(waveform, aligner.sample_rate)
+        tokens = TokenPlan.from_lyrics(make_lyrics(duration), aligner).tokens
+        extra = {"frames": emission.size(1), "tokens": sum(map(len, tokens))}
+        emission2d = emission[0]
+        return lambda: aligner.align_emission(tokens, emission2d), duration, "s", extra
+
+    if case.stage == "lyrics":
+        lyrics = make_lyrics(duration)
+        words = [word for line in lyrics.raw.splitlines() for word in line.split()]
+
+        def split():
+            for word in words:
+                auto_split(normalize_uroman(word))
+
+        return split, len(words), "words", {}
+
+    if case.stage == "make_ass":
+        aligner = TinyTorchAudioForcedAligner()
+        lyrics = make_lyrics(duration)
+        sample_rate = aligner.sample_rate
+        waveform = torch.zeros(1, int(duration * sample_rate))
+        num_frames = aligner.num_frames(waveform.size(1))
+        emission = torch.zeros(1, num_frames, 28)
+        token_plan = TokenPlan.from_lyrics(lyrics, aligner)
+        spans = even_token_spans(token_plan, num_frames)
+        alignment = ForcedAlignment.from_spans(
+            spans, emission, waveform.size(1), sample_rate
+        )
+        nb_lines = len(lyrics.lines)
+
+        def run():
+            make_ass(lyrics, token_plan, alignment)
+
+        return run, nb_lines, "lines", {}
+
+    raise ValueError(f"Unknown stage: {case.stage}")
+
+
+def run_case(case: Case, repeat: int, threads: int):
+    torch.set_num_threads(threads)
+    fn, work, unit, extra = prepare(case)
+    fn()  # warmup
+    profiler = Profiler()
+    for _ in range(repeat):
+        with profiler.stage(case.stage), torch.inference_mode():
+            fn()
+    return Result(
+        case.stage,
+        case.params,
+        runs=[record.wall_time for record in profiler.records],
+        cpu_time=statistics.median(record.cpu_time for record in profiler.records),
+        peak_rss=profiler.records[-1].peak_rss,
+        work=work,
+        unit=unit,
+        extra=extra,
+    )
+
+
+def make_cases(durations: list[float], stages: list[str]):
+    cases: list[Case] = []
+    for duration in durations:
+        cases.append(Case("demucs", {"duration": duration, "batch_size": 1}))
+        cases.append(Case("demucs", {"duration": duration, "batch_size": 4}))
+        for aligner in ("torchaudio", "wav2vec2"):
+            for chunk_length in (None, 30.0):
+                if chunk_length is None and duration > 60:
+                    continue  # the full attention does not fit in memory
+                params = {
+                    "duration": duration,
+                    "aligner": aligner,
+                    "chunk_length": chunk_length,
+                }
+                cases.append(Case("emission", params))
+            params = {"duration": duration, "aligner": aligner, "chunk_length": 30.0}
+            cases.append(Case("trellis", params))
+        cases.append(Case("lyrics", {"duration": duration}))
+        cases.append(Case("make_ass", {"duration": duration}))
+    return [case for case in cases if case.stage in stages]
+
+
+def metadata(threads: int, repeat: int):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "threads": threads,
+        "repeat": repeat,
+    }
+
+
+STAGES = ["demucs", "emission", "trellis", "lyrics", "make_ass"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(__doc__ or "").strip().split("\n\n")[0]
+    )
+    parser.add_argument(
+        "--durations",
+        type=float,
+        nargs="+",
+        default=[60, 240, 600],
+        help="Lengths in seconds of the synthetic songs.",
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each case.")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads.")
+    parser.add_argument("-o", "--output", type=Path, help="JSON results file.")
+    args = parser.parse_args()
+
+    results: list[Result] = []
+    mp_context = multiprocessing.get_context("spawn")
+    for case in make_cases(args.durations, args.stages):
+        with ProcessPoolExecutor(1, mp_context=mp_context) as executor:
+            result = executor.submit(run_case, case, args.repeat, args.threads).result()
+        results.append(result)
+        peak_rss = f"{result.peak_rss / 2**20:.0f} MiB" if result.peak_rss else "n/a"
+        print(
+            f"{case.name}: {result.median:.3f}s, "
+            f"{result.throughput:.1f} {result.unit}/s, peak RSS {peak_rss}",
+            file=sys.stderr,
+        )
+
+    report = {
+        "metadata": metadata(args.threads, args.repeat),
+        "results": [result.to_json() for result in results],
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compare two benchmark results files written by bench.py.
+
+    uv run python benchmarks/compare.py baseline.json results.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def load(path: Path):
+    report = json.loads(path.read_text())
+    return report["metadata"], {
+        (result["stage"], json.dumps(result["params"], sort_keys=True)): result
+        for result in report["results"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(__doc__ or "").strip().split("\n\n")[0]
+    )
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown or memory increase reported as a regression.",
+    )
+    args = parser.parse_args()
+
+    baseline_meta, baseline = load(args.baseline)
+    candidate_meta, candidate = load(args.candidate)
+    print(f"baseline:  {baseline_meta['commit']} ({baseline_meta['date']})")
+    print(f"candidate: {candidate_meta['commit']} ({candidate_meta['date']})")
+
+    regressions = 0
+    for key, new in candidate.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        time_ratio = new["median"] / old["median"]
+        rss_ratio = (
+            new["peak_rss"] / old["peak_rss"]
+            if new["peak_rss"] and old["peak_rss"]
+            else 1.0
+        )
+        regressed = max(time_ratio, rss_ratio) > 1 + args.threshold
+        regressions += regressed
+        stage, params = key
+        print(
+            f"{'!' if regressed else ' '} {stage} {params}: "
+            f"time x{time_ratio:.2f} ({old['median']:.3f}s -> {new['median']:.3f}s), "
+            f"peak RSS x{rss_ratio:.2f}"
+        )
+
+    if regressions:
+        print(f"{regressions} regression(s) above {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Check that the CLI starts fast: --help and the argument validation must not import
+the heavy modules and must stay within a time budget.
+
+    uv run --all-extras python benchmarks/startup.py --budget 1.0
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = [
+    "numpy",
+    "onnxruntime",
+    "torch",
+    "torchaudio",
+    "torchcodec",
+    "transformers",
+    "vocal_remover",
+    "yt_dlp",
+]
+
+INVOCATIONS = [
+    ["--help"],
+    ["generate", "--help"],
+    ["batch", "--help"],
+    ["generate"],  # missing argument
+    ["generate", "song.mkv", "--backend", "nope"],  # invalid option
+]
+
+
+def imported_modules(importtime_log: str):
+    # "import time: self [us] | cumulative | imported package"
+    return {
+        line.rsplit("|", 1)[1].strip()
+        for line in importtime_log.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+def run(args: list[str], repeat: int):
+    command = [sys.executable, "-m", "yohane_cli", *args]
+    durations: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=False, capture_output=True)
+        durations.append(time.perf_counter() - start)
+    # separate run as -X importtime slows the imports down
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", *command[1:]],
+        check=False,
+        capture_output=True,
+        text=True,
+    )
+    heavy = sorted(imported_modules(process.stderr).intersection(HEAVY_MODULES))
+    return min(durations), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(__doc__ or "").strip().split("\n\n")[0]
+    )
+    parser.add_argument(
+        "--budget", type=float, default=1.0, help="Maximum startup time in seconds."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each command.")
+    args = parser.parse_args()
+
+    failures = 0
+    for invocation in INVOCATIONS:
+        duration, heavy = run(invocation, args.repeat)
+        ok = duration <= args.budget and not heavy
+        failures += not ok
+        print(
+            f"{'ok' if ok else 'FAIL':4} {duration:.3f}s yohane {' '.join(invocation)}"
+            + (f" (imports {', '.join(heavy)})" if heavy else "")
+        )
+
+    if failures:
+        print(f"{failures} invocation(s) over the {args.budget}s budget or too heavy")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+
+import pytest
+import torch
+from torchaudio.models import wav2vec2_model
+from transformers import (
+    Wav2Vec2Config,
+    Wav2Vec2CTCTokenizer,
+    Wav2Vec2FeatureExtractor,
+    Wav2Vec2ForCTC,
+    Wav2Vec2Processor,
+)
+
+from yohane.audio import (
+    ForcedAligner,
+    TorchAudioForcedAligner,
+    Wav2Vec2ForcedAligner,
+)
+
+
+class _LogSoftmax(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None):
+        emission, lengths = self.model(waveforms, lengths)
+        return torch.log_softmax(emission, dim=-1), lengths
+
+
+class TinyTorchAudioForcedAligner(TorchAudioForcedAligner):
+    def __init__(self) -> None:
+        ForcedAligner.__init__(self)
+        torch.manual_seed(0)
+        params = dict(self.bundle._params)
+        params.update(
+            extractor_conv_layer_config=[
+                (32, kernel, stride)
+                for _, kernel, stride in params["extractor_conv_layer_config"]
+            ],
+            encoder_embed_dim=64,
+            encoder_pos_conv_kernel=16,
+            encoder_pos_conv_groups=4,
+            encoder_num_layers=1,
+            encoder_num_heads=2,
+            encoder_ff_interm_features=128,
+        )
+        self.tokenizer = self.bundle.get_tokenizer()
+        self.model = _LogSoftmax(wav2vec2_model(**params)).eval()
+        self.device = torch.device("cpu")
+        self.aligner = self.bundle.get_aligner()
+
+
+def tiny_wav2vec2(path: Path, layer_norm: bool):
+    """Tiny Wav2Vec2ForCTC, only the layer norm ones take an attention mask"""
+    vocab = ["<pad>", "<s>", "</s>", "<unk>", "|", *"abcdefghijklmnopqrstuvwxyz'"]
+    vocab_file = path / "vocab.json"
+    vocab_file.write_text(json.dumps({token: i for i, token in enumerate(vocab)}))
+    tokenizer = Wav2Vec2CTCTokenizer(vocab_file.as_posix())
+    feature_extractor = Wav2Vec2FeatureExtractor(
+        do_normalize=True, return_attention_mask=layer_norm
+    )
+    Wav2Vec2Processor(feature_extractor, tokenizer).save_pretrained(path)
+    torch.manual_seed(0)
+    config = Wav2Vec2Config(
+        vocab_size=len(vocab),
+        pad_token_id=0,
+        hidden_size=64,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=128,
+        conv_dim=(32,) * 7,
+        num_conv_pos_embeddings=16,
+        num_conv_pos_embedding_groups=4,
+        feat_extract_norm="layer" if layer_norm else "group",
+        do_stable_layer_norm=layer_norm,
+    )
+    Wav2Vec2ForCTC(config).eval().save_pretrained(path)
+    return Wav2Vec2ForcedAligner(path.as_posix())
+
+
+@pytest.fixture(params=["torchaudio", "wav2vec2-layer", "wav2vec2-group"])
+def aligner(request: pytest.FixtureRequest, tmp_path: Path) -> ForcedAligner:
+    if request.param == "torchaudio":
+        return TinyTorchAudioForcedAligner()
+    return tiny_wav2vec2(tmp_path, layer_norm=request.param == "wav2vec2-layer")
+
+
+def test_batched_emission_matches_single(aligner: ForcedAligner):
+    torch.manual_seed(0)
+    sample_rate = aligner.sample_rate
+    audios = [
+        (torch.randn(1, n * sample_rate // 10), sample_rate) for n in [15, 7, 12, 3]
+    ]
+
+    batched = aligner.emission_batch(audios, batch_size=3)
+    for audio, emission in zip(audios, batched):
+        single = aligner.emission(*audio)
+        assert emission.shape == single.shape
+        torch.testing.assert_close(emission, single, atol=1e-4, rtol=1e-4)
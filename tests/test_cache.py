@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+
+import torch
+
+from yohane.cache import ArtifactCache
+
+
+def entry_size(tmp_path: Path):
+    """Size of a cache entry of a 1000-float tensor"""
+    cache = ArtifactCache(tmp_path / "probe")
+    cache.save("probe", torch.zeros(1000), sample_rate=16000)
+    return sum(path.stat().st_size for path in cache.directory.iterdir())
+
+
+def age(cache: ArtifactCache, key: str, mtime: float):
+    os.utime(cache.directory / f"{key}.npy", (mtime, mtime))
+
+
+def test_roundtrip(tmp_path: Path):
+    cache = ArtifactCache(tmp_path)
+    tensor = torch.arange(10, dtype=torch.float32)
+    cache.save("key", tensor, sample_rate=16000)
+
+    restored = cache.load("key")
+    assert restored is not None
+    assert torch.equal(restored[0], tensor)
+    assert restored[1] == {"sample_rate": 16000}
+    assert cache.load("missing") is None
+
+
+def test_evicts_least_recently_used(tmp_path: Path):
+    size = entry_size(tmp_path)
+    cache = ArtifactCache(tmp_path / "cache", max_size=3 * size)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.save(key, torch.zeros(1000), sample_rate=16000)
+        age(cache, key, 1000 + i)
+
+    # a is used again: b becomes the least recently used
+    assert cache.load("a") is not None
+    cache.save("d", torch.zeros(1000), sample_rate=16000)
+
+    assert cache.load("b") is None
+    for key in ["a", "c", "d"]:
+        assert cache.load(key) is not None
+
+
+def test_evicts_down_to_max_size(tmp_path: Path):
+    size = entry_size(tmp_path)
+    cache = ArtifactCache(tmp_path / "cache", max_size=2 * size)
+    for i in range(5):
+        cache.save(str(i), torch.zeros(1000), sample_rate=16000)
+        age(cache, str(i), 1000 + i)
+    cache.evict()
+
+    assert [key for key in map(str, range(5)) if cache.load(key)] == ["3", "4"]
+    total = sum(path.stat().st_size for path in cache.directory.iterdir())
+    assert total <= 2 * size
+
+
+def test_evicts_downloads_with_the_entries(tmp_path: Path):
+    size = entry_size(tmp_path)
+    cache = ArtifactCache(tmp_path / "cache", max_size=3 * size)
+    media = cache.directory / "media"
+    media.mkdir()
+    # a download as big as a cache entry, with its sidecar
+    (media / "Youtube-a.audio.webm").write_bytes(b"\0" * (size - 2))
+    (media / "Youtube-a.audio.json").write_text("{}")
+    os.utime(media / "Youtube-a.audio.webm", (1000, 1000))
+    os.utime(media / "Youtube-a.audio.json", (1000, 1000))
+    # files without a sidecar only count towards the size
+    (media / "Youtube-b.audio.webm.part").write_bytes(b"\0" * 10)
+    os.utime(media / "Youtube-b.audio.webm.part", (0, 0))
+    for i, key in enumerate(["b", "c"]):
+        cache.save(key, torch.zeros(1000), sample_rate=16000)
+        age(cache, key, 1001 + i)
+
+    cache.save("d", torch.zeros(1000), sample_rate=16000)
+
+    assert not (media / "Youtube-a.audio.webm").exists()
+    assert not (media / "Youtube-a.audio.json").exists()
+    assert (media / "Youtube-b.audio.webm.part").exists()
+    assert cache.load("b") is None
+    for key in ["c", "d"]:
+        assert cache.load(key) is not None
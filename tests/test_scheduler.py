@@ -0,0 +1,17 @@
+from typing import cast
+
+import torch
+
+from yohane.pipeline import Yohane
+from yohane.scheduler import PipelineScheduler, SchedulerConfig
+
+
+def test_threads_are_restored():
+    previous = torch.get_num_threads()
+    threads = previous + 1
+    # no jobs: the models of the Yohane instance are never used
+    scheduler = PipelineScheduler(cast(Yohane, None), SchedulerConfig(threads=threads))
+    run = scheduler.run([])
+
+    assert list(run) == []
+    assert torch.get_num_threads() == previous
@@ -0,0 +1,66 @@
+import multiprocessing
+from multiprocessing.context import ForkContext, SpawnContext
+from multiprocessing.queues import Queue
+from pathlib import Path
+
+import pytest
+import torch
+from test_audio import TinyTorchAudioForcedAligner
+
+from yohane.pipeline import Yohane
+from yohane.shared import SharedArtifacts, default_shared_dir
+
+CONTEXTS = [multiprocessing.get_context("fork"), multiprocessing.get_context("spawn")]
+
+
+def shared_files():
+    return set(default_shared_dir().glob("yohane-*"))
+
+
+def off_vocal(artifacts: SharedArtifacts, results: Queue):
+    yohane = Yohane(separator=None, forced_aligner=TinyTorchAudioForcedAligner())
+    yohane.load_shared(artifacts)
+    off_vocal = yohane.extract_off_vocal()
+    assert off_vocal is not None
+    # as numpy: torch shares tensors through file descriptors of the sender
+    results.put(off_vocal[0].numpy())
+    # no reset: the handles are released when the process exits
+
+
+def share(directory: Path):
+    yohane = Yohane(separator=None, forced_aligner=TinyTorchAudioForcedAligner())
+    yohane.song = (torch.ones(2, 1000), 16000)
+    yohane.share(directory)
+    # neither reset nor sent
+
+
+@pytest.mark.parametrize("context", CONTEXTS, ids=lambda c: c.get_start_method())
+def test_handoff_to_another_process(context: ForkContext | SpawnContext):
+    before = shared_files()
+    song, vocals = torch.randn(2, 16000), torch.randn(2, 16000)
+    yohane = Yohane(separator=None, forced_aligner=TinyTorchAudioForcedAligner())
+    yohane.song = (song, 16000)
+    yohane.vocals = (vocals, 16000)
+
+    results = context.Queue()
+    process = context.Process(target=off_vocal, args=(yohane.share(), results))
+    process.start()
+    off_vocal_waveform = results.get(timeout=60)
+    process.join(timeout=60)
+    yohane.reset()
+
+    assert process.exitcode == 0
+    assert torch.equal(torch.from_numpy(off_vocal_waveform), song - vocals)
+    assert shared_files() == before
+
+
+@pytest.mark.parametrize("context", CONTEXTS, ids=lambda c: c.get_start_method())
+def test_unclaimed_handles_are_released_on_exit(
+    context: ForkContext | SpawnContext, tmp_path: Path
+):
+    process = context.Process(target=share, args=(tmp_path,))
+    process.start()
+    process.join(timeout=60)
+
+    assert process.exitcode == 0
+    assert list(tmp_path.iterdir()) == []
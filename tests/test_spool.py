@@ -0,0 +1,110 @@
+import os
+import time
+from pathlib import Path
+
+from yohane.spool import Spool, work
+
+
+def expire(spool: Spool):
+    """Age every claimed job past its lease"""
+    past = time.time() - 2 * spool.lease
+    claimed_dir = spool.directory / "claimed"
+    for name in os.listdir(claimed_dir):
+        os.utime(claimed_dir / name, (past, past))
+
+
+def test_claim_is_exclusive(tmp_path: Path):
+    spool = Spool(tmp_path)
+    spool.enqueue("song.mkv", "lyrics")
+
+    job = spool.claim("a")
+    assert job is not None and job.worker == "a"
+    assert spool.claim("b") is None
+    assert spool.complete(job)
+    assert spool.counts() == {"pending": 0, "claimed": 0, "done": 1, "failed": 0}
+
+
+def test_fifo(tmp_path: Path):
+    spool = Spool(tmp_path)
+    for song in ["1", "2", "3"]:
+        spool.enqueue(song, "lyrics")
+
+    claimed = [spool.claim("a") for _ in range(3)]
+    assert [job.song for job in claimed if job is not None] == ["1", "2", "3"]
+
+
+def test_heartbeat_keeps_the_lease(tmp_path: Path):
+    spool = Spool(tmp_path, lease=60.0)
+    spool.enqueue("song.mkv", "lyrics")
+    job = spool.claim("a")
+    assert job is not None
+
+    assert spool.heartbeat(job)
+    spool.recover_expired()
+    assert spool.counts()["claimed"] == 1
+
+
+def test_expired_lease_is_reclaimed(tmp_path: Path):
+    spool = Spool(tmp_path, lease=60.0)
+    spool.enqueue("song.mkv", "lyrics")
+    stale = spool.claim("a")
+    assert stale is not None
+
+    expire(spool)
+    job = spool.claim("b")
+    assert job is not None and job.id == stale.id and job.worker == "b"
+    assert job.attempts == 1 and job.error is not None
+
+    # the stale worker can neither renew nor finish the claim of the new one
+    assert not spool.heartbeat(stale)
+    assert not spool.complete(stale)
+    assert not spool.fail(stale, "error")
+    assert not spool.release(stale)
+    assert spool.counts()["claimed"] == 1
+
+    assert spool.heartbeat(job)
+    assert spool.complete(job)
+    assert spool.counts() == {"pending": 0, "claimed": 0, "done": 1, "failed": 0}
+
+
+def test_failed_jobs_are_retried(tmp_path: Path):
+    spool = Spool(tmp_path, max_attempts=2)
+    spool.enqueue("song.mkv", "lyrics")
+
+    job = spool.claim("a")
+    assert job is not None
+    assert spool.fail(job, "error")
+    assert spool.counts()["pending"] == 1
+
+    job = spool.claim("a")
+    assert job is not None and job.attempts == 1
+    assert spool.fail(job, "error")
+    assert spool.counts() == {"pending": 0, "claimed": 0, "done": 0, "failed": 1}
+
+
+def test_release_does_not_count_an_attempt(tmp_path: Path):
+    spool = Spool(tmp_path)
+    spool.enqueue("song.mkv", "lyrics")
+    job = spool.claim("a")
+    assert job is not None
+    assert spool.release(job)
+
+    job = spool.claim("b")
+    assert job is not None and job.attempts == 0
+
+
+def test_work(tmp_path: Path):
+    spool = Spool(tmp_path, max_attempts=1)
+    for song in ["ok", "broken", "ok"]:
+        spool.enqueue(song, "lyrics")
+
+    processed: list[str] = []
+
+    def process(job):
+        if job.song == "broken":
+            raise RuntimeError("broken song")
+        processed.append(job.song)
+
+    work(spool, "a", process, poll_interval=0.0, exit_when_empty=True)
+    assert processed == ["ok", "ok"]
+    assert spool.counts() == {"pending": 0, "claimed": 0, "done": 2, "failed": 1}
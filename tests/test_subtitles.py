@@ -0,0 +1,119 @@
+import random
+
+import pytest
+import torch
+from torchaudio.functional import TokenSpan
+
+from yohane.alignment import ForcedAlignment
+from yohane.lyrics import Lyrics
+from yohane.subtitles import TimedSyllable, make_ass, time_lyrics
+from yohane.tokens import TokenPlan, _make_token_plan
+
+LYRICS = """\
+kimi no na wa
+hello world sakura
+
+yume wo miteru
+a
+"""
+
+
+def tokenize(batch: list[str]):
+    """One token per letter, like the character vocabularies of the aligners"""
+    return [[ord(c) - ord("a") + 1 for c in text] for text in batch]
+
+
+def make_alignment(plan: TokenPlan, seed: int):
+    """Random monotonic spans for the tokens of each word"""
+    rng = random.Random(seed)
+    token_spans: list[list[TokenSpan]] = []
+    frame = 0
+    for tokens in plan.tokens:
+        spans: list[TokenSpan] = []
+        for token in tokens:
+            frame += rng.randint(0, 20)
+            end = frame + rng.randint(1, 10)
+            spans.append(TokenSpan(token, frame, end, rng.random()))
+            frame = end
+        token_spans.append(spans)
+    emission = torch.zeros(1, frame + 10, 28)
+    return ForcedAlignment.from_spans(token_spans, emission, 320 * (frame + 10), 16000)
+
+
+def reference_time_lyrics(lyrics: Lyrics, plan: TokenPlan, alignment: ForcedAlignment):
+    """Per-syllable loop which time_syllables replaced"""
+    token_spans_iter = iter(alignment.token_spans)
+    syllable_counts = iter(plan.syllable_counts.tolist())
+    ratio, sample_rate = alignment.frame_ratio, alignment.sample_rate
+    all_line_syllables: list[list[TimedSyllable | None]] = []
+    for line in lyrics.lines:
+        line_syllables: list[TimedSyllable | None] = []
+        for word in line.words:
+            spans = next(token_spans_iter)
+            span_idx = 0
+            for syllable in word.syllables:
+                nb_tokens = next(syllable_counts)
+                t_start = ratio * spans[span_idx].start / sample_rate
+                t_end = ratio * spans[span_idx + nb_tokens - 1].end / sample_rate
+                line_syllables.append(TimedSyllable(syllable, t_start, t_end))
+                span_idx += nb_tokens
+            line_syllables.append(None)
+        all_line_syllables.append(line_syllables[:-1])
+    return all_line_syllables
+
+
+def reference_karaoke(line_syllables: list[TimedSyllable | None]):
+    text = ""
+    for i, syllable in enumerate(line_syllables):
+        if syllable is None:
+            continue
+        value = syllable.value
+        snap_to = None
+        if i < len(line_syllables) - 1:
+            next_syllable = line_syllables[i + 1]
+            if next_syllable is None:
+                value += " "
+                next_syllable = line_syllables[i + 2]
+            assert next_syllable is not None
+            snap_to = next_syllable.start_s
+        text += rf"{{\k{syllable.k_duration(snap_to=snap_to)}}}{value}"
+    return text
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_time_lyrics_matches_the_per_syllable_loop(seed: int):
+    lyrics = Lyrics(LYRICS)
+    plan = _make_token_plan(lyrics.raw, tokenize)
+    alignment = make_alignment(plan, seed)
+
+    assert time_lyrics(lyrics, plan, alignment) == reference_time_lyrics(
+        lyrics, plan, alignment
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_make_ass_matches_the_per_syllable_loop(seed: int):
+    lyrics = Lyrics(LYRICS)
+    plan = _make_token_plan(lyrics.raw, tokenize)
+    alignment = make_alignment(plan, seed)
+
+    subs = make_ass(lyrics, plan, alignment)
+    events = [event for event in subs.events if not event.is_comment]
+    reference = reference_time_lyrics(lyrics, plan, alignment)
+    assert len(events) == len(reference)
+    for event, line_syllables in zip(events, reference):
+        first, last = line_syllables[0], line_syllables[-1]
+        assert first is not None and last is not None
+        assert event.start == round(first.start_s * 1000)
+        assert event.end == round(last.end_s * 1000)
+        assert event.text == reference_karaoke(line_syllables)
+
+
+def test_missing_spans_are_detected():
+    lyrics = Lyrics(LYRICS)
+    plan = _make_token_plan(lyrics.raw, tokenize)
+    alignment = make_alignment(plan, 0)
+    alignment.span_counts = alignment.span_counts[:-1]
+
+    with pytest.raises(RuntimeError):
+        time_lyrics(lyrics, plan, alignment)
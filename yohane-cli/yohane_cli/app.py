@@ -1,82 +1,548 @@
 import logging
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Annotated
+from typing import TYPE_CHECKING, Annotated
 
 import typer
 
-from yohane import Yohane
-from yohane_cli.audio import (
-    SeparatorChoice,
-    get_separator,
-    parse_song_argument,
-    save_separated_tracks,
-)
-from yohane_cli.lyrics import parse_lyrics_argument
+# the commands import the heavy modules (torch, transformers, yt-dlp...) themselves
+# so that --help and the argument validation stay fast
+from yohane.backends import InferenceBackend
+from yohane_cli.audio import SeparatorChoice
+
+if TYPE_CHECKING:
+    from pysubs2 import SSAFile
+
+    from yohane import Yohane
+    from yohane.batch import BatchJob
 
 logger = logging.getLogger(__name__)
 
 app = typer.Typer()
 
+# arguments and options shared by several commands
+SongArgument = Annotated[
+    str,
+    typer.Argument(
+        help="Video or audio file of the song. Can be an URL to download with yt-dlp.",
+    ),
+]
+
+ManifestArgument = Annotated[
+    Path,
+    typer.Argument(
+        help="Tab-separated file with one 'song<TAB>lyrics' pair per line. Songs can be URLs to download with yt-dlp.",
+    ),
+]
+
+SpoolArgument = Annotated[
+    Path,
+    typer.Argument(
+        help="Spool directory, e.g. on a network share.",
+    ),
+]
+
+SeparatorOption = Annotated[
+    SeparatorChoice | None,
+    typer.Option(
+        "--separator",
+        "-s",
+        help="Optional source separator to use.",
+    ),
+]
+
+SeparatorSegmentOption = Annotated[
+    float | None,
+    typer.Option(
+        help="Separate the song by overlapping segments of this many seconds with the vocal-remover separator, to bound its memory usage. The output slightly differs at the segment boundaries. (Default: the whole song at once)",
+    ),
+]
+
+SeparatorWorkersOption = Annotated[
+    int,
+    typer.Option(
+        help="Number of song segments separated concurrently by the vocal-remover separator (with --separator-segment).",
+    ),
+]
+
+ForcedAlignerOption = Annotated[
+    str | None,
+    typer.Option(
+        "--forced-aligner",
+        "-a",
+        help="Forced aligner (Wav2Vec2-based) model to use. (Default: torchaudio's MMS-FA)",
+    ),
+]
+
+ChunkLengthOption = Annotated[
+    float | None,
+    typer.Option(
+        help="Run the forced aligner on overlapping windows of this many seconds to bound memory usage.",
+    ),
+]
+
+ChunkBatchSizeOption = Annotated[
+    int,
+    typer.Option(
+        help="Number of forced aligner windows to run in a single batch.",
+    ),
+]
+
+BackendOption = Annotated[
+    InferenceBackend,
+    typer.Option(
+        "--backend",
+        "-b",
+        help="Inference backend of the forced aligner model.",
+    ),
+]
+
+VadOption = Annotated[
+    bool,
+    typer.Option(
+        "--vad",
+        help="Skip the instrumental sections (detected on the vocals if separated) during forced alignment.",
+    ),
+]
+
+HierarchicalOption = Annotated[
+    bool,
+    typer.Option(
+        "--hierarchical",
+        help="Anchor the lines on a coarse alignment first, then align each line within its window.",
+    ),
+]
+
+CacheDirOption = Annotated[
+    Path | None,
+    typer.Option(
+        help="Directory where intermediate results (e.g. separated vocals) and downloaded songs are cached, e.g. ~/.cache/yohane. Its size, downloads included, is bounded to 10 GiB by evicting the least recently used entries. (Default: no cache)",
+    ),
+]
+
+CheckpointDirOption = Annotated[
+    Path | None,
+    typer.Option(
+        help="Keep the result of each stage in a subdirectory per song, to resume an interrupted run from the last completed stage.",
+    ),
+]
+
+VideoOption = Annotated[
+    bool,
+    typer.Option(
+        "--video",
+        help="Download the video of URL songs instead of the audio only.",
+    ),
+]
+
+ProfileOption = Annotated[
+    Path | None,
+    typer.Option(
+        help="Record the time, CPU and memory usage of each pipeline stage into this Chrome trace (JSON) file.",
+    ),
+]
+
 
 @app.command(help="Generate a karaoke (full pipeline)")
 def generate(
-    song_file: Annotated[
-        str,
-        typer.Argument(
-            help="Video or audio file of the song. Can be an URL to download with yt-dlp.",
-        ),
-    ],
+    song_file: SongArgument,
     lyrics_file: Annotated[
         Path | None,
         typer.Argument(
             help="Text file which contains the lyrics. (Optional: otherwise, a text editor will open.)",
         ),
     ] = None,
-    separator_choice: Annotated[
-        SeparatorChoice | None,
+    separator_choice: SeparatorOption = None,
+    separator_segment: SeparatorSegmentOption = None,
+    separator_workers: SeparatorWorkersOption = 1,
+    forced_aligner: ForcedAlignerOption = None,
+    chunk_length: ChunkLengthOption = None,
+    chunk_batch_size: ChunkBatchSizeOption = 1,
+    backend: BackendOption = InferenceBackend.Eager,
+    vad: VadOption = False,
+    hierarchical: HierarchicalOption = False,
+    cache_dir: CacheDirOption = None,
+    checkpoint_dir: CheckpointDirOption = None,
+    video: VideoOption = False,
+    incremental: Annotated[
+        bool,
         typer.Option(
-            "--separator",
-            "-s",
-            help="Optional source separator to use.",
+            "--incremental",
+            "-i",
+            help="Only re-time the lines which changed since the existing .ass result.",
+        ),
+    ] = False,
+    profile: ProfileOption = None,
+):
+    from pysubs2 import SSAFile
+
+    from yohane_cli.audio import parse_song_argument, save_separated_tracks
+    from yohane_cli.cache import get_media_cache_dir, get_song_checkpoint_dir
+    from yohane_cli.lyrics import parse_lyrics_argument
+
+    media_cache_dir = get_media_cache_dir(cache_dir)
+    with parse_song_argument(
+        song_file, video=video, media_cache_dir=media_cache_dir
+    ) as (song, output):
+        lyrics = parse_lyrics_argument(lyrics_file)
+        yohane = make_yohane(
+            separator_choice=separator_choice,
+            separator_segment=separator_segment,
+            separator_workers=separator_workers,
+            forced_aligner=forced_aligner,
+            chunk_length=chunk_length,
+            chunk_batch_size=chunk_batch_size,
+            backend=backend,
+            vad=vad,
+            hierarchical=hierarchical,
+            cache_dir=cache_dir,
+            profile=profile is not None,
+        )
+        song_checkpoint_dir = get_song_checkpoint_dir(checkpoint_dir, song, output)
+        if song_checkpoint_dir is not None:
+            yohane.resume_from(song_checkpoint_dir)
+
+        yohane.load_song(song)
+        yohane.load_lyrics(lyrics)
+
+        yohane.extract_vocals()
+        with yohane.profiler.stage("encode"):
+            save_separated_tracks(yohane, output)
+
+        subs_file = output.with_suffix(".ass")
+        if incremental and subs_file.is_file():
+            previous = SSAFile.load(subs_file.as_posix())
+            subs = yohane.realign_subs(previous)
+        else:
+            yohane.force_align()
+            subs = yohane.make_subs()
+        with yohane.profiler.stage("encode"):
+            save_subs(subs, output)
+
+        save_profile(yohane, profile)
+
+
+@app.command(help="Generate karaokes for every song of a manifest (full pipeline)")
+def batch(
+    manifest_file: ManifestArgument,
+    separator_choice: SeparatorOption = None,
+    separator_segment: SeparatorSegmentOption = None,
+    separator_workers: SeparatorWorkersOption = 1,
+    forced_aligner: ForcedAlignerOption = None,
+    chunk_length: ChunkLengthOption = None,
+    chunk_batch_size: ChunkBatchSizeOption = 1,
+    backend: BackendOption = InferenceBackend.Eager,
+    vad: VadOption = False,
+    hierarchical: HierarchicalOption = False,
+    cache_dir: CacheDirOption = None,
+    checkpoint_dir: CheckpointDirOption = None,
+    video: VideoOption = False,
+    profile: ProfileOption = None,
+    align_batch_size: Annotated[
+        int,
+        typer.Option(
+            help="Number of songs aligned together in a single forward pass of the forced aligner model. (Not in pipeline mode)",
+        ),
+    ] = 1,
+    pipeline: Annotated[
+        bool,
+        typer.Option(
+            "--pipeline",
+            help="Overlap the stages of different songs: download and decode, separate, align and write run concurrently.",
+        ),
+    ] = False,
+    decode_workers: Annotated[
+        int,
+        typer.Option(
+            help="Number of songs decoded concurrently in pipeline mode.",
+        ),
+    ] = 2,
+    threads: Annotated[
+        int | None,
+        typer.Option(
+            help="Torch intra-op threads in pipeline mode, shared by all the stages. (Default: torch default)",
+        ),
+    ] = None,
+):
+    from yohane.batch import BatchJob, run_batch
+    from yohane.scheduler import PipelineScheduler, SchedulerConfig, StageConfig
+    from yohane_cli.audio import parse_song_argument
+    from yohane_cli.cache import get_media_cache_dir, get_song_checkpoint_dir
+    from yohane_cli.lyrics import parse_lyrics_argument
+    from yohane_cli.manifest import parse_manifest
+
+    entries = parse_manifest(manifest_file)
+    media_cache_dir = get_media_cache_dir(cache_dir)
+    failures: list[str] = []
+
+    with ExitStack() as stack:
+
+        def prepare_jobs():
+            for song_file, lyrics_file in entries:
+                try:
+                    song, output = stack.enter_context(
+                        parse_song_argument(
+                            song_file, video=video, media_cache_dir=media_cache_dir
+                        )
+                    )
+                    lyrics = parse_lyrics_argument(lyrics_file)
+                except Exception:
+                    logger.exception(f"Failed to prepare '{song_file}'")
+                    failures.append(song_file)
+                    continue
+                job_checkpoint_dir = get_song_checkpoint_dir(
+                    checkpoint_dir, song, output
+                )
+                yield BatchJob(song, lyrics, output, job_checkpoint_dir)
+
+        jobs = prepare_jobs() if pipeline else list(prepare_jobs())
+
+        yohane = make_yohane(
+            separator_choice=separator_choice,
+            separator_segment=separator_segment,
+            separator_workers=separator_workers,
+            forced_aligner=forced_aligner,
+            chunk_length=chunk_length,
+            chunk_batch_size=chunk_batch_size,
+            backend=backend,
+            vad=vad,
+            hierarchical=hierarchical,
+            cache_dir=cache_dir,
+            profile=profile is not None,
+        )
+
+        if pipeline:
+            config = SchedulerConfig(
+                decode=StageConfig(workers=decode_workers), threads=threads
+            )
+            scheduler = PipelineScheduler(yohane, config, write=save_batch_outputs)
+            results = scheduler.run(jobs)
+        else:
+            results = run_batch(
+                yohane,
+                jobs,
+                after_separation=save_batch_tracks,
+                align_batch_size=align_batch_size,
+            )
+
+        for result in results:
+            if not result.ok:
+                failures.append(result.job.song_file.as_posix())
+            elif not pipeline:
+                assert result.subs is not None
+                with yohane.profiler.stage("encode"):
+                    save_subs(result.subs, result.job.output)
+
+    save_profile(yohane, profile)
+
+    logger.info(f"Batch done: {len(entries) - len(failures)}/{len(entries)} succeeded")
+    if failures:
+        for failure in failures:
+            logger.error(f"Failed: '{failure}'")
+        raise typer.Exit(1)
+
+
+@app.command(help="Add the songs of a manifest to a spool shared by workers")
+def enqueue(
+    spool_dir: SpoolArgument,
+    manifest_file: ManifestArgument,
+    output_dir: Annotated[
+        Path | None,
+        typer.Option(
+            help="Directory where the workers write the results. (Default: next to the song file, or the working directory of the worker for URLs)",
         ),
     ] = None,
-    forced_aligner: Annotated[
+):
+    from yohane.spool import Spool
+    from yohane_cli.manifest import parse_manifest
+
+    spool = Spool(spool_dir)
+    entries = parse_manifest(manifest_file)
+    for song_file, lyrics_file in entries:
+        # the workers may run in another directory
+        if (song_path := Path(song_file)).is_file():
+            song_file = song_path.resolve().as_posix()
+        job = spool.enqueue(
+            song_file,
+            lyrics_file.read_text(),
+            output_dir.resolve().as_posix() if output_dir is not None else None,
+        )
+        logger.info(f"Enqueued '{song_file}' as job {job.id}")
+
+    logger.info(f"Spool: {spool.counts()}")
+
+
+@app.command(help="Generate the karaokes of the jobs of a spool (full pipeline)")
+def worker(
+    spool_dir: SpoolArgument,
+    separator_choice: SeparatorOption = None,
+    separator_segment: SeparatorSegmentOption = None,
+    separator_workers: SeparatorWorkersOption = 1,
+    forced_aligner: ForcedAlignerOption = None,
+    chunk_length: ChunkLengthOption = None,
+    chunk_batch_size: ChunkBatchSizeOption = 1,
+    backend: BackendOption = InferenceBackend.Eager,
+    vad: VadOption = False,
+    hierarchical: HierarchicalOption = False,
+    cache_dir: CacheDirOption = None,
+    checkpoint_dir: CheckpointDirOption = None,
+    video: VideoOption = False,
+    name: Annotated[
         str | None,
         typer.Option(
-            "--forced-aligner",
-            "-a",
-            help="Forced aligner (Wav2Vec2-based) model to use. (Default: torchaudio's MMS-FA)",
+            help="Name of the worker in the spool. (Default: hostname-pid)",
         ),
     ] = None,
+    lease: Annotated[
+        float,
+        typer.Option(
+            help="Seconds after which the job of a worker which stopped sending heartbeats is put back in the queue.",
+        ),
+    ] = 300.0,
+    max_attempts: Annotated[
+        int,
+        typer.Option(
+            help="Number of times a failing job is tried before it is moved to the failed jobs.",
+        ),
+    ] = 3,
+    poll_interval: Annotated[
+        float,
+        typer.Option(
+            help="Seconds to wait before looking for new jobs when the queue is empty.",
+        ),
+    ] = 10.0,
+    exit_when_empty: Annotated[
+        bool,
+        typer.Option(
+            "--exit-when-empty",
+            help="Stop once the queue is empty instead of waiting for new jobs.",
+        ),
+    ] = False,
 ):
-    with parse_song_argument(song_file) as (song, output):
-        lyrics = parse_lyrics_argument(lyrics_file)
-        separator = get_separator(separator_choice)
+    import os
+    import socket
 
-        yohane = Yohane(separator=separator, forced_aligner=forced_aligner)
+    from yohane.batch import BatchJob, run_batch
+    from yohane.spool import Spool, SpoolJob, work
+    from yohane_cli.audio import parse_song_argument
+    from yohane_cli.cache import get_media_cache_dir, get_song_checkpoint_dir
 
-        yohane.load_song(song)
-        yohane.load_lyrics(lyrics)
+    spool = Spool(spool_dir, lease=lease, max_attempts=max_attempts)
+    worker_name = name or f"{socket.gethostname()}-{os.getpid()}"
+    media_cache_dir = get_media_cache_dir(cache_dir)
 
-        yohane.extract_vocals()
-        save_separated_tracks(yohane, output)
+    # the models are loaded once and stay warm between the jobs
+    yohane = make_yohane(
+        separator_choice=separator_choice,
+        separator_segment=separator_segment,
+        separator_workers=separator_workers,
+        forced_aligner=forced_aligner,
+        chunk_length=chunk_length,
+        chunk_batch_size=chunk_batch_size,
+        backend=backend,
+        vad=vad,
+        hierarchical=hierarchical,
+        cache_dir=cache_dir,
+    )
 
-        yohane.force_align()
+    def process(job: SpoolJob):
+        with parse_song_argument(
+            job.song, video=video, media_cache_dir=media_cache_dir
+        ) as (song, output):
+            if job.output_dir is not None:
+                output = Path(job.output_dir) / output.name
+            job_checkpoint_dir = get_song_checkpoint_dir(checkpoint_dir, song, output)
+            batch_job = BatchJob(song, job.lyrics, output, job_checkpoint_dir)
+            (result,) = run_batch(
+                yohane, [batch_job], after_separation=save_batch_tracks
+            )
+            if result.error is not None:
+                raise result.error
+            assert result.subs is not None
+            save_subs(result.subs, output)
 
-        subs = yohane.make_subs()
-        subs_file = output.with_suffix(".ass")
-        subs.save(subs_file.as_posix())
-        logger.info(f"Result saved to '{subs_file.as_posix()}'")
+    logger.info(f"Worker {worker_name} polling '{spool_dir.as_posix()}'")
+    work(
+        spool,
+        worker_name,
+        process,
+        poll_interval=poll_interval,
+        exit_when_empty=exit_when_empty,
+    )
+    logger.info(f"Spool: {spool.counts()}")
 
 
-@app.command(help="Seperate vocals and instrumental tracks")
-def separate(
-    song_file: Annotated[
+@app.command(
+    help="Keep the models loaded and serve alignments on a local HTTP API. Use a --cache-dir so that a re-time reuses the separated vocals and the emission of the song."
+)
+def serve(
+    separator_choice: SeparatorOption = None,
+    separator_segment: SeparatorSegmentOption = None,
+    separator_workers: SeparatorWorkersOption = 1,
+    forced_aligner: ForcedAlignerOption = None,
+    chunk_length: ChunkLengthOption = None,
+    chunk_batch_size: ChunkBatchSizeOption = 1,
+    backend: BackendOption = InferenceBackend.Eager,
+    vad: VadOption = False,
+    hierarchical: HierarchicalOption = False,
+    cache_dir: CacheDirOption = None,
+    video: VideoOption = False,
+    host: Annotated[
         str,
-        typer.Argument(
-            help="Video or audio file of the song. Can be an URL to download with yt-dlp.",
+        typer.Option(
+            help="Address to listen on.",
         ),
-    ],
+    ] = "127.0.0.1",
+    port: Annotated[
+        int,
+        typer.Option(
+            help="Port to listen on.",
+        ),
+    ] = 8765,
+    align_batch_size: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of concurrent requests aligned together in a single forward pass of the forced aligner model.",
+        ),
+    ] = 4,
+    batch_window: Annotated[
+        float,
+        typer.Option(
+            help="Seconds to wait for concurrent requests to batch with the first one.",
+        ),
+    ] = 0.01,
+):
+    from yohane_cli.cache import get_media_cache_dir
+    from yohane_cli.server import AlignmentService
+    from yohane_cli.server import serve as serve_forever
+
+    yohane = make_yohane(
+        separator_choice=separator_choice,
+        separator_segment=separator_segment,
+        separator_workers=separator_workers,
+        forced_aligner=forced_aligner,
+        chunk_length=chunk_length,
+        chunk_batch_size=chunk_batch_size,
+        backend=backend,
+        vad=vad,
+        hierarchical=hierarchical,
+        cache_dir=cache_dir,
+        cache_song=True,
+    )
+
+    service = AlignmentService(
+        yohane,
+        batch_size=align_batch_size,
+        batch_window=batch_window,
+        video=video,
+        media_cache_dir=get_media_cache_dir(cache_dir),
+    )
+    serve_forever(service, host, port)
+
+
+@app.command(help="Seperate vocals and instrumental tracks")
+def separate(
+    song_file: SongArgument,
     separator_choice: Annotated[
         SeparatorChoice,
         typer.Option(
@@ -85,14 +551,164 @@ def separate(
             help="Source separator to use. 'none' to disable.",
         ),
     ] = SeparatorChoice.VocalRemover,
+    separator_segment: SeparatorSegmentOption = None,
+    separator_workers: SeparatorWorkersOption = 1,
+    cache_dir: CacheDirOption = None,
+    video: VideoOption = False,
+    stream: Annotated[
+        bool,
+        typer.Option(
+            "--stream",
+            help="Decode, separate and write the tracks block by block to bound memory usage. (Disables the cache)",
+        ),
+    ] = False,
+    block_length: Annotated[
+        float,
+        typer.Option(
+            help="Length in seconds of the blocks processed in streaming mode.",
+        ),
+    ] = 30.0,
 ):
-    with parse_song_argument(song_file) as (song, output):
-        separator = get_separator(separator_choice)
+    from yohane.pipeline import Yohane
+    from yohane_cli.audio import (
+        get_separator,
+        parse_song_argument,
+        save_separated_tracks,
+        stream_separated_tracks,
+    )
+    from yohane_cli.cache import get_cache, get_media_cache_dir
+
+    media_cache_dir = get_media_cache_dir(cache_dir)
+    with parse_song_argument(
+        song_file, video=video, media_cache_dir=media_cache_dir
+    ) as (song, output):
+        separator = get_separator(
+            separator_choice, segment=separator_segment, workers=separator_workers
+        )
         if separator is None:
             raise RuntimeError("No separator selected")
 
-        yohane = Yohane(separator=separator)
+        cache = get_cache(cache_dir)
+        yohane = Yohane(separator=separator, cache=cache)
+
+        if stream:
+            blocks = yohane.stream_separated(song, block_length=block_length)
+            stream_separated_tracks(blocks, output)
+            return
+
         yohane.load_song(song)
 
         yohane.extract_vocals()
         save_separated_tracks(yohane, output)
+
+
+@app.command(
+    help="Compare the syllable timings of an inference backend against the fp32 eager baseline"
+)
+def check_backend_accuracy(
+    song_file: SongArgument,
+    lyrics_file: Annotated[
+        Path,
+        typer.Argument(
+            help="Text file which contains the lyrics.",
+        ),
+    ],
+    backend: Annotated[
+        InferenceBackend,
+        typer.Option(
+            "--backend",
+            "-b",
+            help="Inference backend to check.",
+        ),
+    ],
+    separator_choice: SeparatorOption = None,
+    forced_aligner: ForcedAlignerOption = None,
+):
+    from yohane.accuracy import check_backend
+    from yohane.pipeline import Yohane, get_forced_aligner
+    from yohane_cli.audio import get_separator, parse_song_argument
+    from yohane_cli.lyrics import parse_lyrics_argument
+
+    with parse_song_argument(song_file) as (song, _):
+        lyrics = parse_lyrics_argument(lyrics_file)
+        separator = get_separator(separator_choice)
+
+        yohane = Yohane(separator=separator, forced_aligner=forced_aligner)
+        yohane.load_song(song)
+        yohane.load_lyrics(lyrics)
+        yohane.extract_vocals()
+
+        candidate = get_forced_aligner(forced_aligner, backend=backend)
+        result = check_backend(yohane, candidate)
+        logger.info(f"{backend.value} vs eager: {result}")
+
+
+def make_yohane(
+    *,
+    separator_choice: SeparatorChoice | None,
+    separator_segment: float | None,
+    separator_workers: int,
+    forced_aligner: str | None,
+    chunk_length: float | None,
+    chunk_batch_size: int,
+    backend: InferenceBackend,
+    vad: bool,
+    hierarchical: bool,
+    cache_dir: Path | None,
+    profile: bool = False,
+    cache_song: bool = False,
+) -> "Yohane":
+    """Load the models and build the pipeline from the shared options"""
+    from yohane.audio import VoiceActivityGate
+    from yohane.pipeline import Yohane, get_forced_aligner
+    from yohane.profiling import Profiler
+    from yohane_cli.audio import get_separator
+    from yohane_cli.cache import get_cache, get_onnx_dir
+
+    separator = get_separator(
+        separator_choice, segment=separator_segment, workers=separator_workers
+    )
+    aligner = get_forced_aligner(
+        forced_aligner,
+        chunk_length=chunk_length,
+        chunk_batch_size=chunk_batch_size,
+        backend=backend,
+        onnx_dir=get_onnx_dir(cache_dir),
+    )
+    return Yohane(
+        separator=separator,
+        forced_aligner=aligner,
+        cache=get_cache(cache_dir),
+        gate=VoiceActivityGate() if vad else None,
+        hierarchical=hierarchical,
+        profiler=Profiler() if profile else None,
+        cache_song=cache_song,
+    )
+
+
+def save_batch_tracks(yohane: "Yohane", job: "BatchJob"):
+    from yohane_cli.audio import save_separated_tracks
+
+    with yohane.profiler.stage("encode"):
+        save_separated_tracks(yohane, job.output)
+
+
+def save_batch_outputs(yohane: "Yohane", job: "BatchJob", subs: "SSAFile"):
+    from yohane_cli.audio import save_separated_tracks
+
+    save_separated_tracks(yohane, job.output)
+    save_subs(subs, job.output)
+
+
+def save_profile(yohane: "Yohane", profile: Path | None):
+    from yohane.profiling import Profiler
+
+    if profile is not None and isinstance(yohane.profiler, Profiler):
+        yohane.profiler.save(profile)
+        logger.info(f"Profile saved to '{profile.as_posix()}'")
+
+
+def save_subs(subs: "SSAFile", output: Path):
+    subs_file = output.with_suffix(".ass")
+    subs.save(subs_file.as_posix())
+    logger.info(f"Result saved to '{subs_file.as_posix()}'")
@@ -1,35 +1,115 @@
+import json
 import logging
-from collections.abc import Generator
+import os
+import struct
+from collections.abc import Generator, Iterable
 from contextlib import contextmanager
 from enum import Enum
 from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-from torchcodec.encoders._audio_encoder import AudioEncoder
-from yt_dlp import YoutubeDL
+if TYPE_CHECKING:
+    import torch
 
-from yohane import Yohane
-from yohane.audio import HybridDemucsSeparator, Separator, VocalRemoverSeparator
+    from yohane import Yohane
+    from yohane.audio import Separator
 
 logger = logging.getLogger(__name__)
 
 
 @contextmanager
-def parse_song_argument(value: str) -> Generator[tuple[Path, Path]]:
+def parse_song_argument(
+    value: str, *, video: bool = False, media_cache_dir: Path | None = None
+) -> Generator[tuple[Path, Path]]:
     song_path = Path(value)
 
-    if not song_path.is_file():
+    if song_path.is_file():
+        output_path = song_path.with_suffix("")
+    else:
         logger.info("Song file not found, calling yt-dlp")
-        song_path = ydl_download(value)
+        song_path, output_path = ydl_download(
+            value, video=video, media_cache_dir=media_cache_dir
+        )
 
-    output_path = song_path.with_suffix("")
     yield song_path, output_path
 
 
-def ydl_download(value: str) -> Path:
-    with YoutubeDL({"format_sort": ["res:1080", "vcodec:h264", "acodec:aac"]}) as ydl:
+def ydl_download(
+    value: str, *, video: bool = False, media_cache_dir: Path | None = None
+) -> tuple[Path, Path]:
+    """
+    Download the best audio stream only (or the video with `video`), and return
+    the downloaded file and the output path for the results.
+
+    With a `media_cache_dir`, the downloads are kept there and found again from the
+    URL without calling yt-dlp when the extractor can tell the id from it.
+    """
+    from yt_dlp import YoutubeDL
+
+    modes = ["video"] if video else ["audio", "video"]  # the video has the audio
+    if media_cache_dir is not None and (key := _media_key(value)) is not None:
+        for mode in modes:
+            if (cached := _load_cached_media(media_cache_dir, key, mode)) is not None:
+                logger.info(f"Using the cached download '{cached[0].as_posix()}'")
+                return cached
+
+    params: dict[str, Any] = (
+        {"format_sort": ["res:1080", "vcodec:h264", "acodec:aac"]}
+        if video
+        else {"format": "bestaudio/best"}
+    )
+    if media_cache_dir is not None:
+        params["paths"] = {"home": media_cache_dir.as_posix()}
+        params["outtmpl"] = f"%(extractor_key)s-%(id)s.{modes[0]}.%(ext)s"
+
+    with YoutubeDL(params) as ydl:  # pyright: ignore[reportArgumentType]
         info = ydl.extract_info(value)
-        filename = ydl.prepare_filename(info)
-        return Path(filename)
+        song_path = Path(ydl.prepare_filename(info))
+        # the results are written in the working directory, named after the title
+        output_name = Path(ydl.prepare_filename(info, outtmpl=OUTPUT_TEMPLATE)).name
+        output_path = Path(output_name).with_suffix("")
+
+    if media_cache_dir is not None:
+        key = f"{info['extractor_key']}-{info['id']}"  # pyright: ignore[reportGeneralTypeIssues]
+        _save_cached_media(media_cache_dir, key, modes[0], song_path, output_path)
+
+    return song_path, output_path
+
+
+OUTPUT_TEMPLATE = "%(title)s [%(id)s].%(ext)s"  # yt-dlp default
+
+
+def _media_key(url: str):
+    """Identify the media from its URL only, without network"""
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for ie in gen_extractor_classes():
+        if ie.suitable(url) and ie.ie_key() != "Generic":
+            media_id = ie.get_temp_id(url)
+            return f"{ie.ie_key()}-{media_id}" if media_id else None
+    return None
+
+
+def _load_cached_media(media_cache_dir: Path, key: str, mode: str):
+    try:
+        entry = json.loads((media_cache_dir / f"{key}.{mode}.json").read_text())
+    except (OSError, ValueError):
+        return None
+    song_path = media_cache_dir / entry["file"]
+    if not song_path.is_file():
+        return None
+    try:
+        os.utime(song_path)  # mark as recently used for the eviction
+    except OSError:  # just evicted
+        return None
+    return song_path, Path(entry["output"])
+
+
+def _save_cached_media(
+    media_cache_dir: Path, key: str, mode: str, song_path: Path, output_path: Path
+):
+    entry = {"file": song_path.name, "output": output_path.as_posix()}
+    (media_cache_dir / f"{key}.{mode}.json").write_text(json.dumps(entry))
 
 
 class SeparatorChoice(str, Enum):
@@ -37,17 +117,26 @@ class SeparatorChoice(str, Enum):
     HybridDemucs = "hybrid-demucs"
 
 
-def get_separator(separator_choice: SeparatorChoice | None) -> Separator | None:
+def get_separator(
+    separator_choice: SeparatorChoice | None,
+    *,
+    segment: float | None = None,
+    workers: int = 1,
+) -> "Separator | None":
+    from yohane.audio import HybridDemucsSeparator, VocalRemoverSeparator
+
     match separator_choice:
         case SeparatorChoice.VocalRemover:
-            return VocalRemoverSeparator()
+            return VocalRemoverSeparator(segment=segment, workers=workers)
         case SeparatorChoice.HybridDemucs:
             return HybridDemucsSeparator()
         case _:
             return None
 
 
-def save_separated_tracks(yohane: Yohane, output: Path):
+def save_separated_tracks(yohane: "Yohane", output: Path):
+    from torchcodec.encoders._audio_encoder import AudioEncoder
+
     if yohane.vocals is not None:
         waveform, sample_rate = yohane.vocals
         filename = output.with_suffix(".vocals.wav")
@@ -59,3 +148,82 @@ def save_separated_tracks(yohane: Yohane, output: Path):
         filename = output.with_suffix(".off_vocal.wav")
         logger.info(f"Saving off vocal track to {filename}")
         AudioEncoder(waveform, sample_rate=sample_rate).to_file(filename.as_posix())
+
+
+def stream_separated_tracks(
+    blocks: Iterable[tuple["torch.Tensor", "torch.Tensor", int]], output: Path
+):
+    vocals_file = output.with_suffix(".vocals.wav")
+    off_vocal_file = output.with_suffix(".off_vocal.wav")
+    logger.info(f"Streaming vocals track to {vocals_file}")
+    logger.info(f"Streaming off vocal track to {off_vocal_file}")
+    vocals_writer = off_vocal_writer = None
+    try:
+        for vocals, off_vocal, sample_rate in blocks:
+            if vocals_writer is None or off_vocal_writer is None:
+                vocals_writer = WavWriter(vocals_file, sample_rate, vocals.size(0))
+                off_vocal_writer = WavWriter(
+                    off_vocal_file, sample_rate, off_vocal.size(0)
+                )
+            vocals_writer.write(vocals)
+            off_vocal_writer.write(off_vocal)
+    finally:
+        if vocals_writer is not None:
+            vocals_writer.close()
+        if off_vocal_writer is not None:
+            off_vocal_writer.close()
+
+
+class WavWriter:
+    """Incremental 32-bit float WAV writer"""
+
+    # the RIFF chunk sizes are 32-bit: 4 GiB minus the headers after the size field
+    MAX_DATA_SIZE = 0xFFFFFFFF - 50
+
+    def __init__(self, path: Path, sample_rate: int, num_channels: int):
+        self.path = path
+        self.file = path.open("wb")
+        self.num_channels = num_channels
+        self.data_size = 0
+        block_align = num_channels * 4
+        self.file.write(b"RIFF\0\0\0\0WAVE")
+        self.file.write(
+            struct.pack(
+                "<4sIHHIIHHH",
+                b"fmt ",
+                18,
+                3,  # WAVE_FORMAT_IEEE_FLOAT
+                num_channels,
+                sample_rate,
+                sample_rate * block_align,
+                block_align,
+                32,
+                0,  # no extension
+            )
+        )
+        # required for non-PCM formats: number of sample frames
+        self.file.write(b"fact\4\0\0\0\0\0\0\0")
+        self.file.write(b"data\0\0\0\0")
+
+    def write(self, waveform: "torch.Tensor"):
+        """Append a (channels, samples) block"""
+        import torch
+
+        assert waveform.size(0) == self.num_channels
+        data = waveform.detach().cpu().to(torch.float32).T.contiguous().numpy()
+        if self.data_size + data.nbytes > self.MAX_DATA_SIZE:
+            raise ValueError(
+                f"{self.path.as_posix()} would exceed the 4 GiB limit of WAV files"
+            )
+        self.file.write(data.tobytes())
+        self.data_size += data.nbytes
+
+    def close(self):
+        # fill in the chunk sizes now that the data length is known
+        self.file.seek(4)
+        self.file.write(struct.pack("<I", 50 + self.data_size))
+        self.file.seek(46)
+        self.file.write(struct.pack("<I", self.data_size // (self.num_channels * 4)))
+        self.file.seek(54)
+        self.file.write(struct.pack("<I", self.data_size))
+        self.file.close()
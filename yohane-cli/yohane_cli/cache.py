@@ -0,0 +1,45 @@
+import hashlib
+import logging
+from pathlib import Path
+
+from yohane.cache import ArtifactCache
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache(cache_dir: Path | None) -> ArtifactCache | None:
+    if cache_dir is None:
+        return None
+    cache = ArtifactCache(cache_dir)
+    logger.info(
+        f"Caching intermediate results in {cache_dir} "
+        f"(up to {cache.max_size / 1024**3:g} GiB)"
+    )
+    return cache
+
+
+def get_media_cache_dir(cache_dir: Path | None) -> Path | None:
+    """Where the songs downloaded from URLs are kept"""
+    if cache_dir is None:
+        return None
+    return cache_dir / "media"
+
+
+def get_onnx_dir(cache_dir: Path | None) -> Path | None:
+    """Where the models exported for the ONNX backend are kept"""
+    if cache_dir is None:
+        return None
+    return cache_dir / "onnx"
+
+
+def get_song_checkpoint_dir(
+    checkpoint_dir: Path | None, song: Path, output: Path
+) -> Path | None:
+    """
+    Checkpoint subdirectory of a song, named after its output and keyed on its
+    path so that songs with the same name in different directories do not collide
+    """
+    if checkpoint_dir is None:
+        return None
+    digest = hashlib.sha256(song.resolve().as_posix().encode()).hexdigest()
+    return checkpoint_dir / f"{output.name}-{digest[:12]}"
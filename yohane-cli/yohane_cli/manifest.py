@@ -0,0 +1,27 @@
+import csv
+from pathlib import Path
+
+
+def parse_manifest(manifest_file: Path) -> list[tuple[str, Path]]:
+    """
+    Read a tab-separated manifest of `song<TAB>lyrics` lines.
+
+    Songs may be files or URLs to download with yt-dlp. Relative paths are
+    resolved against the manifest directory. Empty lines and lines starting
+    with `#` are ignored.
+    """
+    entries: list[tuple[str, Path]] = []
+    base_dir = manifest_file.parent
+    with manifest_file.open(newline="") as f:
+        for lineno, row in enumerate(csv.reader(f, delimiter="\t"), start=1):
+            if not row or not row[0].strip() or row[0].startswith("#"):
+                continue
+            if len(row) != 2:
+                raise ValueError(
+                    f"{manifest_file.as_posix()}:{lineno}: expected 'song<TAB>lyrics'"
+                )
+            song, lyrics = (col.strip() for col in row)
+            if (song_path := base_dir / song).is_file():
+                song = song_path.as_posix()
+            entries.append((song, base_dir / lyrics))
+    return entries
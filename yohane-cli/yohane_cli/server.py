@@ -0,0 +1,248 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from pysubs2 import SSAFile
+
+from yohane.pipeline import Yohane, batch_emissions
+from yohane_cli.audio import parse_song_argument
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AlignRequest:
+    song: str  # file or URL
+    lyrics: str
+    # .ass made from previous lyrics: only the edited lines are re-timed
+    previous: str | None = None
+    upload: Path | None = None  # uploaded song, deleted once the request is done
+    future: Future[str] = field(default_factory=Future)
+
+
+class AlignmentService:
+    """
+    Align the requests on a single thread which owns the models, by groups of up to
+    `batch_size` requests arrived within `batch_window` seconds of each other.
+
+    The artifacts of the songs are kept between the requests in the size-bounded
+    cache of `yohane` (if any), so a re-time only computes what the edit changed.
+    Uploaded songs are deleted as soon as their requests are done.
+    """
+
+    def __init__(
+        self,
+        yohane: Yohane,
+        *,
+        batch_size: int = 4,
+        batch_window: float = 0.01,
+        video: bool = False,
+        media_cache_dir: Path | None = None,
+    ):
+        self.yohane = yohane
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.video = video
+        self.media_cache_dir = media_cache_dir
+        self.queue: queue.Queue[AlignRequest] = queue.Queue()
+        self._uploads = tempfile.TemporaryDirectory(prefix="yohane-serve-")
+        # number of pending requests of each upload, the same song can be in flight
+        # several times
+        self._upload_refs: dict[Path, int] = {}
+        self._upload_lock = threading.Lock()
+
+    def submit(self, request: AlignRequest):
+        if request.upload is not None:
+            upload = request.upload
+            request.future.add_done_callback(lambda _: self.release_upload(upload))
+        self.queue.put(request)
+        return request.future
+
+    def upload(self, data: bytes):
+        """
+        Store an uploaded song until `release_upload`. It is named after its content,
+        with a fixed mtime, so that its cache keys are the same at each upload.
+        """
+        path = Path(self._uploads.name) / hashlib.sha256(data).hexdigest()
+        with self._upload_lock:
+            if path not in self._upload_refs:
+                path.write_bytes(data)
+                os.utime(path, ns=(0, 0))
+            self._upload_refs[path] = self._upload_refs.get(path, 0) + 1
+        return path
+
+    def release_upload(self, path: Path):
+        with self._upload_lock:
+            self._upload_refs[path] -= 1
+            if not self._upload_refs[path]:
+                del self._upload_refs[path]
+                path.unlink(missing_ok=True)
+
+    def run(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                group = [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_window
+            while len(group) < self.batch_size:
+                try:
+                    timeout = max(0.0, deadline - time.monotonic())
+                    group.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._process(group)
+        self._uploads.cleanup()
+
+    def _process(self, requests: list[AlignRequest]):
+        logger.info(f"Aligning {len(requests)} request(s)")
+        with ExitStack() as stack:
+            prepared: list[tuple[AlignRequest, Yohane]] = []
+            for request in requests:
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    song = self._prepare(request, stack)
+                except Exception as e:
+                    logger.exception(f"Failed to process '{request.song}'")
+                    request.future.set_exception(e)
+                else:
+                    prepared.append((request, song))
+
+            fresh = [song for request, song in prepared if request.previous is None]
+            emissions = iter(batch_emissions(fresh, self.batch_size))
+
+            for request, song in prepared:
+                try:
+                    if request.previous is not None:
+                        subs = song.realign_subs(SSAFile.from_string(request.previous))
+                    else:
+                        song.force_align(next(emissions))
+                        subs = song.make_subs()
+                except Exception as e:
+                    logger.exception(f"Failed to process '{request.song}'")
+                    request.future.set_exception(e)
+                else:
+                    request.future.set_result(subs.to_string("ass"))
+                finally:
+                    song.reset()
+
+    def _prepare(self, request: AlignRequest, stack: ExitStack):
+        song_file, _ = stack.enter_context(
+            parse_song_argument(
+                request.song, video=self.video, media_cache_dir=self.media_cache_dir
+            )
+        )
+        song = self.yohane.for_song()
+        song.load_song(song_file)
+        song.load_lyrics(request.lyrics)
+        song.extract_vocals()
+        return song
+
+
+class AlignmentServer(ThreadingHTTPServer):
+    """
+    Local HTTP API of an `AlignmentService`:
+
+    - `POST /align` with a JSON object: `lyrics`, and either `song` (file or URL)
+      or `audio` (base64-encoded audio file), and optionally `previous` (.ass to
+      re-time). Returns the .ass.
+    - `GET /health`
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: AlignmentService):
+        super().__init__(address, _Handler)
+        self.service = service
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: AlignmentServer  # pyright: ignore[reportIncompatibleVariableOverride]
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        queued = self.server.service.queue.qsize()
+        self._send_json(HTTPStatus.OK, {"status": "ok", "queued": queued})
+
+    def do_POST(self):
+        if self.path != "/align":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        try:
+            request = self._parse_request()
+        except (ValueError, TypeError) as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+
+        future = self.server.service.submit(request)
+        try:
+            ass = future.result()
+        except Exception as e:
+            # already logged by the service
+            logger.debug(f"Failed request for '{request.song}'", exc_info=True)
+            self._send_json(
+                HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+            )
+            return
+
+        body = ass.encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/x-ssa; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse_request(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length))
+        if not isinstance(data, dict) or not isinstance(data.get("lyrics"), str):
+            raise TypeError("expected a JSON object with 'lyrics'")
+        previous = data.get("previous")
+        if previous is not None and not isinstance(previous, str):
+            raise TypeError("'previous' must be the .ass text")
+        if isinstance(audio := data.get("audio"), str):
+            upload = self.server.service.upload(base64.b64decode(audio))
+            return AlignRequest(upload.as_posix(), data["lyrics"], previous, upload)
+        if isinstance(data.get("song"), str):
+            return AlignRequest(data["song"], data["lyrics"], previous)
+        raise TypeError("expected 'song' or 'audio'")
+
+    def _send_json(self, status: HTTPStatus, data: dict[str, Any]):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug(format % args)
+
+
+def serve(service: AlignmentService, host: str, port: int):
+    stop = threading.Event()
+    worker = threading.Thread(target=service.run, args=(stop,), name="align")
+    worker.start()
+    with AlignmentServer((host, port), service) as server:
+        logger.info(f"Listening on http://{host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        finally:
+            stop.set()
+            worker.join()
@@ -1,5 +1,17 @@
-from yohane.pipeline import Yohane
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from yohane.pipeline import Yohane
 
 __all__ = [
     "Yohane",
 ]
+
+
+def __getattr__(name: str):
+    # lazy so that importing a light submodule (e.g. from the CLI) skips torch
+    if name == "Yohane":
+        from yohane.pipeline import Yohane
+
+        return Yohane
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,86 @@
+import logging
+import time
+from dataclasses import dataclass
+
+import torch
+
+from yohane.audio import ForcedAligner
+from yohane.pipeline import Yohane
+from yohane.subtitles import TimedSyllable, time_lyrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TimingComparison:
+    num_syllables: int
+    mean_error: float  # s
+    p95_error: float  # s
+    max_error: float  # s
+
+    def __str__(self):
+        return (
+            f"{self.num_syllables} syllables: mean error {self.mean_error * 1000:.1f}ms, "
+            f"p95 {self.p95_error * 1000:.1f}ms, max {self.max_error * 1000:.1f}ms"
+        )
+
+
+@dataclass
+class BackendCheck:
+    comparison: TimingComparison
+    reference_time: float  # s
+    candidate_time: float  # s
+
+    def __str__(self):
+        return (
+            f"{self.comparison} "
+            f"(alignment took {self.candidate_time:.2f}s vs {self.reference_time:.2f}s)"
+        )
+
+
+def compare_timings(
+    reference: list[list[TimedSyllable | None]],
+    candidate: list[list[TimedSyllable | None]],
+):
+    """Compare the start and end times of the syllables of two timings"""
+    errors: list[float] = []
+    for reference_line, candidate_line in zip(reference, candidate, strict=True):
+        for ref, cand in zip(reference_line, candidate_line, strict=True):
+            if ref is None or cand is None:
+                continue
+            errors.append(abs(ref.start_s - cand.start_s))
+            errors.append(abs(ref.end_s - cand.end_s))
+    errors_t = torch.tensor(errors) if errors else torch.zeros(1)
+    return TimingComparison(
+        num_syllables=len(errors) // 2,
+        mean_error=errors_t.mean().item(),
+        p95_error=errors_t.quantile(0.95).item(),
+        max_error=errors_t.max().item(),
+    )
+
+
+def check_backend(yohane: Yohane, candidate: ForcedAligner):
+    """
+    Compare the syllable timings of the `candidate` aligner (e.g. with a quantized
+    backend) against the current aligner of `yohane`, whose song and lyrics must
+    already be loaded.
+    """
+    reference = yohane.forced_aligner
+    reference_timings, reference_time = _timed_alignment(yohane)
+    yohane.forced_aligner = candidate
+    try:
+        candidate_timings, candidate_time = _timed_alignment(yohane)
+    finally:
+        yohane.forced_aligner = reference
+    comparison = compare_timings(reference_timings, candidate_timings)
+    return BackendCheck(comparison, reference_time, candidate_time)
+
+
+def _timed_alignment(yohane: Yohane):
+    logger.info(f"Timing lyrics with {yohane.forced_aligner.identity}")
+    start = time.perf_counter()
+    yohane.force_align()
+    elapsed = time.perf_counter() - start
+    assert yohane.lyrics is not None and yohane.forced_alignment is not None
+    timings = time_lyrics(yohane.lyrics, yohane.token_plan, yohane.forced_alignment)
+    return timings, elapsed
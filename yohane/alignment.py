@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+
+import torch
+from torchaudio.functional import TokenSpan
+
+
+@dataclass
+class ForcedAlignment:
+    """
+    Compact forced alignment of a song: the token spans as flat arrays, without the
+    frames x vocabulary emission.
+    """
+
+    num_frames: int
+    num_samples: int
+    sample_rate: int
+    span_counts: torch.Tensor  # number of spans of each word
+    tokens: torch.Tensor
+    starts: torch.Tensor  # frames
+    ends: torch.Tensor  # frames
+    scores: torch.Tensor
+
+    @classmethod
+    def from_spans(
+        cls,
+        token_spans: list[list[TokenSpan]],
+        emission: torch.Tensor,
+        num_samples: int,
+        sample_rate: int,
+    ):
+        spans = [span for word_spans in token_spans for span in word_spans]
+        return cls(
+            num_frames=emission.size(1),
+            num_samples=num_samples,
+            sample_rate=sample_rate,
+            span_counts=torch.tensor([len(s) for s in token_spans], dtype=torch.int32),
+            tokens=torch.tensor([s.token for s in spans], dtype=torch.int32),
+            starts=torch.tensor([s.start for s in spans], dtype=torch.int32),
+            ends=torch.tensor([s.end for s in spans], dtype=torch.int32),
+            scores=torch.tensor([s.score for s in spans], dtype=torch.float32),
+        )
+
+    @property
+    def frame_ratio(self):
+        """Audio samples per emission frame"""
+        return self.num_samples / self.num_frames
+
+    @property
+    def token_spans(self):
+        spans = [
+            TokenSpan(token, start, end, score)
+            for token, start, end, score in zip(
+                self.tokens.tolist(),
+                self.starts.tolist(),
+                self.ends.tolist(),
+                self.scores.tolist(),
+            )
+        ]
+        token_spans: list[list[TokenSpan]] = []
+        offset = 0
+        for count in self.span_counts.tolist():
+            token_spans.append(spans[offset : offset + count])
+            offset += count
+        return token_spans
@@ -1,21 +1,147 @@
 import logging
+import math
+import threading
 from abc import ABC, abstractmethod
 from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path
 from typing import Any, cast
 
 import torch
-from torchaudio.functional import TokenSpan, merge_tokens, resample
+from torchaudio.functional import TokenSpan, merge_tokens
 from torchaudio.pipelines import HDEMUCS_HIGH_MUSDB_PLUS, MMS_FA
 from torchaudio.pipelines._wav2vec2 import aligner
-from torchaudio.transforms import Fade
 from transformers import Wav2Vec2CTCTokenizer, Wav2Vec2ForCTC, Wav2Vec2Processor
 
+from yohane.backends import EmissionFn, InferenceBackend, apply_backend
+from yohane.cache import cache_key
+from yohane.resampling import resample
+
 logger = logging.getLogger(__name__)
 
 TokenizerFn = Callable[[list[str]], list[list[int]]]
+AlignFn = Callable[[list[list[int]], torch.Tensor], list[list[TokenSpan]]]
+
+
+@dataclass
+class VoiceActivityGate:
+    """Energy-based detection of the voiced regions of a song"""
+
+    threshold_db: float = -40.0  # relative to the loudest frame
+    frame_length: float = 0.05  # s
+    min_silence: float = 2.0  # s, shorter silences are kept
+    padding: float = 0.5  # s, kept around each voiced region
+
+    def __call__(self, waveform: torch.Tensor, sample_rate: int):
+        """Voiced regions of the waveform, as (start, end) in seconds"""
+        if waveform.dim() > 1:
+            waveform = waveform.mean(0)
+        duration = waveform.size(0) / sample_rate
+        frame = max(1, round(self.frame_length * sample_rate))
+        num_frames = waveform.size(0) // frame
+        if num_frames == 0:
+            return [(0.0, duration)]
+
+        rms = waveform[: num_frames * frame].reshape(num_frames, frame)
+        rms = rms.pow(2).mean(1).sqrt().clamp_min(1e-10)
+        level = 20 * torch.log10(rms / rms.max())  # dB
+        voiced = torch.nn.functional.pad((level > self.threshold_db).int(), (1, 1))
+        edges = voiced.diff().nonzero().squeeze(1).tolist()  # start, end, start...
+
+        frame_s = frame / sample_rate
+        regions: list[tuple[float, float]] = []
+        for i0, i1 in zip(edges[::2], edges[1::2]):
+            start = max(0.0, i0 * frame_s - self.padding)
+            end = min(duration, i1 * frame_s + self.padding)
+            if i1 == num_frames:
+                end = duration  # include the trailing partial frame
+            if regions and start - regions[-1][1] < self.min_silence:
+                regions[-1] = (regions[-1][0], end)
+            else:
+                regions.append((start, end))
+        return regions
+
+
+@dataclass
+class GatingReport:
+    duration: float  # s
+    regions: list[tuple[float, float]] = field(repr=False)
+
+    @property
+    def voiced(self):
+        return sum(end - start for start, end in self.regions)
+
+    @property
+    def skipped(self):
+        return self.duration - self.voiced
+
+    def __str__(self):
+        ratio = self.skipped / self.duration if self.duration else 0
+        return (
+            f"skipped {self.skipped:.1f}s of {self.duration:.1f}s ({ratio:.0%}) "
+            f"outside {len(self.regions)} voiced regions"
+        )
 
 
 class ForcedAligner(ABC):
+    device: torch.device
+    blank: int
+
+    def __init__(
+        self,
+        *,
+        chunk_length: float | None = None,
+        chunk_overlap: float = 1.0,
+        chunk_batch_size: int = 1,
+        backend: InferenceBackend = InferenceBackend.Eager,
+        onnx_dir: Path | None = None,
+    ) -> None:
+        super().__init__()
+        self.backend = backend
+        # where the ONNX exports are kept between the runs, not kept if None
+        self.onnx_dir = onnx_dir
+        # windowed emission: run the model on overlapping windows of chunk_length
+        # seconds instead of the whole song to bound memory usage
+        self.chunk_length = chunk_length
+        self.chunk_overlap = chunk_overlap
+        self.chunk_batch_size = chunk_batch_size
+
+    @property
+    @abstractmethod
+    def model_name(self) -> str: ...
+
+    @property
+    @abstractmethod
+    def sample_rate(self) -> int: ...
+
+    @property
+    def identity(self) -> str:
+        """Identifies the aligner and the parameters affecting its emission"""
+        params = [self.model_name]
+        if self.chunk_length is not None:
+            params.append(f"chunk_length={self.chunk_length}")
+            params.append(f"chunk_overlap={self.chunk_overlap}")
+        if self.backend is not InferenceBackend.Eager:
+            params.append(f"backend={self.backend.value}")
+        return f"{type(self).__name__}({', '.join(params)})"
+
+    @property
+    @abstractmethod
+    def conv_layers(self) -> list[tuple[int, int]]:
+        """(kernel, stride) of the model feature extractor convolutions"""
+        ...
+
+    @property
+    @abstractmethod
+    def pads_exactly(self) -> bool:
+        """
+        Whether a song zero-padded into a batch gets the same emission as on its
+        own. Group norm feature extractors normalize over the padding too.
+        """
+        ...
+
     @abstractmethod
     def tokenize(
         self,
@@ -23,12 +149,340 @@ class ForcedAligner(ABC):
     ) -> list[list[int]]: ...
 
     @abstractmethod
+    def emission_model(self) -> torch.nn.Module:
+        """
+        Module mapping (batch, samples) waveforms and their optional (batch,)
+        lengths to (batch, frames, vocab) log-probs
+        """
+        ...
+
+    @cached_property
+    def _emission_fn(self) -> EmissionFn:
+        onnx_file = (
+            self.onnx_dir / f"{cache_key(self.model_name)}.onnx"
+            if self.onnx_dir is not None
+            else None
+        )
+        return apply_backend(
+            self.emission_model(), self.backend, self.device, onnx_file
+        )
+
+    def compute_emission(
+        self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None
+    ) -> torch.Tensor:
+        """
+        (batch, samples) at self.sample_rate -> (batch, frames, vocab) log-probs.
+        `lengths` are the numbers of samples of zero-padded waveforms.
+        """
+        return self._emission_fn(waveforms, lengths)
+
+    @abstractmethod
+    def align_emission(
+        self,
+        tokens: list[list[int]],
+        emission: torch.Tensor,
+    ) -> list[list[TokenSpan]]: ...
+
+    def num_frames(self, num_samples: int):
+        for kernel, stride in self.conv_layers:
+            num_samples = (num_samples - kernel) // stride + 1
+        return num_samples
+
+    @property
+    def hop_length(self):
+        """Number of samples per emission frame"""
+        return math.prod(stride for _, stride in self.conv_layers)
+
+    def emission(
+        self,
+        waveform: torch.Tensor,
+        sample_rate: int,
+        regions: list[tuple[float, float]] | None = None,
+    ) -> torch.Tensor:
+        """
+        Emission of the waveform. If `regions` (in seconds) are given, the model
+        only runs on them and the other frames are set to blank.
+        """
+        logger.info(
+            f"{type(self).__name__}: running {self.model_name} on {self.device=}"
+        )
+        waveform = resample(waveform, sample_rate, self.sample_rate)
+        waveform = waveform.mean(0)
+        with torch.inference_mode():
+            if regions is None:
+                return self._emission(waveform)[None]
+
+            emission: torch.Tensor | None = None
+            num_frames = self.num_frames(waveform.size(0))
+            for s0, s1, f0, f1 in self._region_frames(regions, waveform.size(0)):
+                region_emission = self._emission(waveform[s0:s1])
+                if emission is None:
+                    emission = region_emission.new_full(
+                        (num_frames, region_emission.size(-1)), float("-inf")
+                    )
+                    emission[:, self.blank] = 0
+                emission[f0:f1] = region_emission[: f1 - f0]
+            assert emission is not None
+            return emission[None]
+
+    def voiced_frames(
+        self, regions: list[tuple[float, float]], num_samples: int, sample_rate: int
+    ):
+        """Mask of the emission frames computed for the given regions"""
+        num_samples = math.ceil(num_samples * self.sample_rate / sample_rate)
+        mask = torch.zeros(self.num_frames(num_samples), dtype=torch.bool)
+        for _, _, f0, f1 in self._region_frames(regions, num_samples):
+            mask[f0:f1] = True
+        return mask
+
+    def _region_frames(self, regions: list[tuple[float, float]], num_samples: int):
+        """(start sample, end sample, start frame, end frame) of each region"""
+        hop = self.hop_length
+        num_frames = self.num_frames(num_samples)
+        region_frames: list[tuple[int, int, int, int]] = []
+        for start, end in regions:
+            f0 = int(start * self.sample_rate) // hop
+            s0 = f0 * hop
+            s1 = min(math.ceil(end * self.sample_rate), num_samples)
+            f1 = min(f0 + self.num_frames(s1 - s0), num_frames)
+            if f1 > f0:
+                region_frames.append((s0, s1, f0, f1))
+        return region_frames
+
+    def _emission(self, waveform: torch.Tensor):
+        if self.chunk_length is None:
+            return self.compute_emission(waveform[None])[0]
+        return self._windowed_emission(waveform, self.chunk_length)
+
+    def _windowed_emission(self, waveform: torch.Tensor, chunk_length: float):
+        hop = self.hop_length
+        window = max(1, round(chunk_length * self.sample_rate / hop)) * hop
+        overlap = max(2, round(self.chunk_overlap * self.sample_rate / hop)) * hop
+        if overlap >= window:
+            raise ValueError("chunk_overlap must be shorter than chunk_length")
+
+        length = waveform.size(0)
+        starts = list(range(0, max(length - overlap, 1), window - overlap))
+        num_frames = self.num_frames(length)
+        skip = overlap // hop // 2  # frames dropped at the start of each window
+        logger.info(
+            f"{type(self).__name__}: windowed emission over {len(starts)} windows"
+        )
+
+        emission: torch.Tensor | None = None
+        for i in range(0, len(starts), self.chunk_batch_size):
+            batch_starts = starts[i : i + self.chunk_batch_size]
+            chunks = [waveform[start : start + window] for start in batch_starts]
+            outputs: list[torch.Tensor] = []
+            # only the last window can be shorter and must run on its own
+            if chunks[-1].size(0) != window:
+                outputs.extend(self._compute_chunks(chunks[:-1]))
+                outputs.extend(self._compute_chunks(chunks[-1:]))
+            else:
+                outputs.extend(self._compute_chunks(chunks))
+
+            for start, output in zip(batch_starts, outputs):
+                if emission is None:
+                    emission = output.new_empty(num_frames, output.size(-1))
+                first = start // hop
+                offset = skip if start > 0 else 0
+                stop = min(first + output.size(0), num_frames)
+                emission[first + offset : stop] = output[offset : stop - first]
+
+        assert emission is not None
+        return emission
+
+    def _compute_chunks(self, chunks: list[torch.Tensor]):
+        if not chunks:
+            return []
+        return list(self.compute_emission(torch.stack(chunks)))
+
     def align(
         self,
         tokens: list[list[int]],
         waveform: torch.Tensor,
         sample_rate: int,
-    ) -> tuple[torch.Tensor, list[list[TokenSpan]]]: ...
+    ) -> tuple[torch.Tensor, list[list[TokenSpan]]]:
+        emission = self.emission(waveform, sample_rate)
+        token_spans = self.align_emission(tokens, emission[0])
+        return emission, token_spans
+
+    def emission_batch(
+        self, audios: list[tuple[torch.Tensor, int]], batch_size: int = 4
+    ) -> list[torch.Tensor]:
+        """
+        Emission of several (waveform, sample rate) songs, zero-padded together into
+        forward passes of up to `batch_size` songs of similar lengths. Windowed
+        aligners (`chunk_length`) already batch their windows and, like the models
+        which do not `pads_exactly`, run each song on its own.
+        """
+        if self.chunk_length is not None or not self.pads_exactly:
+            return [self.emission(*audio) for audio in audios]
+        logger.info(
+            f"{type(self).__name__}: running {self.model_name} on {self.device=} "
+            f"for {len(audios)} songs"
+        )
+        mono = [resample(w, sr, self.sample_rate).mean(0) for w, sr in audios]
+        order = sorted(range(len(mono)), key=lambda i: mono[i].size(0))
+        emissions: dict[int, torch.Tensor] = {}
+        with torch.inference_mode():
+            for k in range(0, len(order), batch_size):
+                indices = order[k : k + batch_size]
+                batch = [mono[i] for i in indices]
+                lengths = torch.tensor([waveform.size(0) for waveform in batch])
+                padded = torch.nn.utils.rnn.pad_sequence(batch, batch_first=True)
+                output = self.compute_emission(
+                    padded, lengths if len(batch) > 1 else None
+                )
+                for i, emission, length in zip(indices, output, lengths.tolist()):
+                    emissions[i] = emission[None, : self.num_frames(length)]
+        return [emissions[i] for i in range(len(mono))]
+
+    def align_batch(
+        self,
+        tokens: list[list[list[int]]],
+        audios: list[tuple[torch.Tensor, int]],
+        batch_size: int = 4,
+    ) -> list[tuple[torch.Tensor, list[list[TokenSpan]]]]:
+        """`align` several songs, with batched forward passes of the model"""
+        emissions = self.emission_batch(audios, batch_size)
+        return [
+            (emission, self.align_emission(song_tokens, emission[0]))
+            for song_tokens, emission in zip(tokens, emissions)
+        ]
+
+    def align_voiced_emission(
+        self,
+        tokens: list[list[int]],
+        emission: torch.Tensor,
+        voiced: torch.Tensor,
+        align_fn: AlignFn | None = None,
+    ):
+        """Align on the voiced frames only, then map the spans back to all frames"""
+        align_fn = align_fn or self.align_emission
+        frames = voiced.nonzero().squeeze(1).tolist()
+        token_spans = align_fn(tokens, emission[voiced.to(emission.device)])
+        return [
+            [
+                TokenSpan(
+                    token=span.token,
+                    start=frames[span.start],
+                    end=frames[span.end - 1] + 1,
+                    score=span.score,
+                )
+                for span in spans
+            ]
+            for spans in token_spans
+        ]
+
+    def align_emission_hierarchical(
+        self,
+        tokens: list[list[int]],
+        emission: torch.Tensor,
+        line_lengths: list[int],
+        *,
+        factor: int = 4,
+        margin: float = 1.0,
+        workers: int | None = None,
+    ):
+        """
+        Two-pass alignment: the line boundaries are first anchored on an emission
+        downsampled by `factor`, then the tokens of each line (`line_lengths` words)
+        are aligned within their anchored window, extended by `margin` seconds.
+
+        The coarse pass is still a trellis over all the tokens, `factor` times
+        shorter than a single pass, while the fine passes only cover their line.
+        The result falls back to a single-pass alignment whenever a line cannot be
+        aligned within its window.
+        """
+        num_frames = emission.size(0)
+        pad = -num_frames % factor
+        coarse = torch.nn.functional.pad(emission, (0, 0, 0, pad), value=-math.inf)
+        coarse = coarse.reshape(-1, factor, emission.size(1))
+        coarse = coarse.logsumexp(1) - math.log(factor)  # mean probability
+        try:
+            coarse_spans = self.align_emission(tokens, coarse)
+        except RuntimeError:
+            logger.warning("Coarse alignment failed, aligning in a single pass")
+            return self.align_emission(tokens, emission)
+
+        margin_frames = round(margin * self.sample_rate / self.hop_length)
+        lines: list[tuple[int, int]] = []  # word range of each line
+        windows: list[tuple[int, int]] = []  # frame range of each line
+        word = 0
+        for length in line_lengths:
+            if length == 0:
+                continue
+            start = coarse_spans[word][0].start * factor
+            end = coarse_spans[word + length - 1][-1].end * factor
+            lines.append((word, word + length))
+            windows.append(
+                (max(0, start - margin_frames), min(num_frames, end + margin_frames))
+            )
+            word += length
+
+        def align_window(i: int, w0: int, w1: int):
+            line_tokens = tokens[slice(*lines[i])]
+            line_spans = self.align_emission(line_tokens, emission[w0:w1])
+            return [
+                [
+                    TokenSpan(
+                        token=span.token,
+                        start=span.start + w0,
+                        end=span.end + w0,
+                        score=span.score,
+                    )
+                    for span in spans
+                ]
+                for spans in line_spans
+            ]
+
+        def widened(i: int):
+            """Window of a line widened up to the windows of the neighbouring lines"""
+            w0 = windows[i - 1][0] if i > 0 else 0
+            w1 = windows[i + 1][1] if i < len(windows) - 1 else num_frames
+            return w0, w1
+
+        def align_line(i: int):
+            for w0, w1 in (windows[i], widened(i)):
+                try:
+                    return align_window(i, w0, w1)
+                except RuntimeError:
+                    pass
+            return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            aligned = list(executor.map(align_line, range(len(lines))))
+
+        # the windows overlap: a line which starts before the end of the previous
+        # one is aligned again on the frames after it, to keep the spans monotonic
+        previous_end = 0
+        for i, line_spans in enumerate(aligned):
+            if line_spans is not None and _spans_start(line_spans) < previous_end:
+                try:
+                    line_spans = align_window(
+                        i, previous_end, max(widened(i)[1], previous_end)
+                    )
+                except RuntimeError:
+                    line_spans = None
+            if line_spans is None:
+                logger.warning(
+                    f"Line {i} could not be aligned within its window, "
+                    "aligning in a single pass"
+                )
+                return self.align_emission(tokens, emission)
+            aligned[i] = line_spans
+            previous_end = _spans_end(line_spans, previous_end)
+
+        return [spans for line_spans in aligned if line_spans for spans in line_spans]
+
+
+def _spans_start(token_spans: list[list[TokenSpan]]):
+    return min((s.start for spans in token_spans for s in spans), default=math.inf)
+
+
+def _spans_end(token_spans: list[list[TokenSpan]], default: int):
+    return max((s.end for spans in token_spans for s in spans), default=default)
 
 
 class TorchAudioForcedAligner(ForcedAligner):
@@ -37,32 +491,48 @@ class TorchAudioForcedAligner(ForcedAligner):
     """
 
     bundle = MMS_FA
+    blank = 0
 
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
         self.tokenizer = self.bundle.get_tokenizer()
         self.model = self.bundle.get_model()
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # pyright: ignore[reportPrivateImportUsage]
         self.model.to(self.device)
         self.aligner = self.bundle.get_aligner()
 
+    @property
+    def model_name(self):
+        return "MMS_FA"
+
+    @property
+    def sample_rate(self):
+        return int(self.bundle.sample_rate)
+
+    @property
+    def conv_layers(self):
+        return [
+            (kernel, stride)
+            for _, kernel, stride in self.bundle._params["extractor_conv_layer_config"]
+        ]
+
+    @property
+    def pads_exactly(self):
+        return self.bundle._params["extractor_mode"] == "layer_norm"
+
     def tokenize(self, batch: list[str]):
         return cast(list[list[int]], self.tokenizer(batch))
 
-    def align(self, tokens: list[list[int]], waveform: torch.Tensor, sample_rate: int):
-        logger.info(f"TorchAudioForcedAligner: running MMS_FA on {self.device=}")
-        waveform = resample(waveform, sample_rate, int(self.bundle.sample_rate))
-        waveform = waveform.mean(0, keepdim=True)
-        with torch.inference_mode():
-            emission, _ = self.model(waveform.to(self.device))
-            emission = cast(torch.Tensor, emission)
-        token_spans = self.aligner(emission[0], tokens)
-        return emission, token_spans
+    def emission_model(self):
+        return _TorchAudioEmission(self.model)
+
+    def align_emission(self, tokens: list[list[int]], emission: torch.Tensor):
+        return self.aligner(emission, tokens)
 
 
 class Wav2Vec2ForcedAligner(ForcedAligner):
-    def __init__(self, model: str) -> None:
-        super().__init__()
+    def __init__(self, model: str, **kwargs) -> None:
+        super().__init__(**kwargs)
         self.model_id = model
         self.processor = Wav2Vec2Processor.from_pretrained(model)
         self.model = Wav2Vec2ForCTC.from_pretrained(model)
@@ -76,25 +546,82 @@ class Wav2Vec2ForcedAligner(ForcedAligner):
     def tokenizer(self) -> Wav2Vec2CTCTokenizer:
         return self.processor.tokenizer  # pyright: ignore[reportAttributeAccessIssue]
 
+    @property
+    def model_name(self):
+        return self.model_id
+
+    @property
+    def sample_rate(self) -> int:
+        return self.processor.feature_extractor.sampling_rate  # pyright: ignore[reportAttributeAccessIssue]
+
+    @property
+    def conv_layers(self):
+        config = self.model.config
+        return list(zip(config.conv_kernel, config.conv_stride))
+
+    @property
+    def pads_exactly(self) -> bool:
+        # only the layer norm models take an attention mask
+        return self.processor.feature_extractor.return_attention_mask  # pyright: ignore[reportAttributeAccessIssue]
+
     def tokenize(self, batch: list[str]):
         return [self.tokenizer.encode(e, add_special_tokens=False) for e in batch]
 
-    def align(self, tokens: list[list[int]], waveform: torch.Tensor, sample_rate: int):
-        logger.info(f"Wav2Vec2ForcedAligner: running {self.model_id} on {self.device=}")
-        target_sample_rate = self.processor.feature_extractor.sampling_rate  # pyright: ignore[reportAttributeAccessIssue]
-        waveform = resample(waveform, sample_rate, target_sample_rate)
-        sample_rate = target_sample_rate
-        waveform = waveform.mean(0)
-        inputs = self.processor(
-            audio=waveform.numpy(),
-            sampling_rate=sample_rate,  # pyright: ignore[reportCallIssue]
-            return_tensors="pt",  # pyright: ignore[reportCallIssue]
+    def emission_model(self):
+        feature_extractor = self.processor.feature_extractor  # pyright: ignore[reportAttributeAccessIssue]
+        return _Wav2Vec2Emission(
+            self.model,
+            normalize=feature_extractor.do_normalize,
+            attention_mask=feature_extractor.return_attention_mask,
         )
-        with torch.inference_mode():
-            outputs = self.model(**inputs.to(self.device))
-            emission = torch.nn.functional.log_softmax(outputs.logits, dim=-1)
-        token_spans = _align_token_spans(emission[0], tokens, blank=self.blank)
-        return emission, token_spans
+
+    def align_emission(self, tokens: list[list[int]], emission: torch.Tensor):
+        return _align_token_spans(emission, tokens, blank=self.blank)
+
+
+class _TorchAudioEmission(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(
+        self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None
+    ) -> torch.Tensor:
+        emission, _ = self.model(waveforms, lengths)
+        return emission
+
+
+class _Wav2Vec2Emission(torch.nn.Module):
+    def __init__(self, model: Wav2Vec2ForCTC, normalize: bool, attention_mask: bool):
+        super().__init__()
+        self.model = model
+        self.normalize = normalize
+        # models with group norm feature extractors expect zero padding, no mask
+        self.attention_mask = attention_mask
+
+    def forward(
+        self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None
+    ) -> torch.Tensor:
+        mask = None
+        if lengths is not None:
+            positions = torch.arange(waveforms.size(-1), device=waveforms.device)
+            mask = positions < lengths[:, None]
+        if self.normalize:  # same as Wav2Vec2FeatureExtractor, on the unpadded part
+            if lengths is None or mask is None:
+                mean = waveforms.mean(-1, keepdim=True)
+                var = waveforms.var(-1, keepdim=True, unbiased=False)
+            else:
+                count = lengths[:, None]
+                mean = (waveforms * mask).sum(-1, keepdim=True) / count
+                var = (((waveforms - mean) * mask) ** 2).sum(-1, keepdim=True) / count
+            waveforms = (waveforms - mean) / torch.sqrt(var + 1e-7)
+            if mask is not None:
+                waveforms = waveforms * mask
+        attention_mask = None
+        if mask is not None and self.attention_mask:
+            attention_mask = mask.long()
+        logits = self.model(waveforms, attention_mask=attention_mask).logits
+        return torch.nn.functional.log_softmax(logits, dim=-1)
 
 
 def _align_token_spans(
@@ -127,6 +654,11 @@ def _unflatten_token_spans(
 
 
 class Separator(ABC):
+    @property
+    def identity(self) -> str:
+        """Identifies the separator and the parameters affecting its output"""
+        return type(self).__name__
+
     @abstractmethod
     def __call__(
         self, waveform: torch.Tensor, sample_rate: int
@@ -136,21 +668,93 @@ class Separator(ABC):
 class VocalRemoverSeparator(Separator):
     """
     https://github.com/tsurumeso/vocal-remover
+
+    With a `segment`, the song is separated by overlapping segments of `segment`
+    seconds crossfaded over `overlap` seconds, so memory usage is bounded by the
+    segment length, and `workers` threads separate segments concurrently. The
+    output then slightly differs from a separation of the whole song at once.
     """
 
-    def __init__(self):
+    def __init__(
+        self, segment: float | None = None, overlap: float = 1.0, workers: int = 1
+    ):
         super().__init__()
         from vocal_remover.transformer.modeling import VocalRemoverModel
         from vocal_remover.transformer.pipeline import VocalRemoverPipeline
 
-        self.model = VocalRemoverModel.from_pretrained(
-            "NextFire/tsurumeso-vocal-remover"
+        self.segment = segment
+        self.overlap = overlap
+        self.workers = workers
+        self.model_id = "NextFire/tsurumeso-vocal-remover"
+        self.model = VocalRemoverModel.from_pretrained(self.model_id)
+        # the pipelines are stateful: one per thread, sharing the model weights
+        self._pipelines = threading.local()
+        self._pipeline_class = VocalRemoverPipeline
+
+    @property
+    def pipeline(self):
+        if (pipeline := getattr(self._pipelines, "pipeline", None)) is None:
+            pipeline = self._pipelines.pipeline = self._pipeline_class(self.model)
+        return pipeline
+
+    @property
+    def identity(self):
+        if self.segment is None:
+            return f"{type(self).__name__}({self.model_id})"
+        return f"{type(self).__name__}({self.model_id}, segment={self.segment}, overlap={self.overlap})"
+
+    def _separate(self, waveform: torch.Tensor):
+        outputs = cast(dict[str, Any], self.pipeline(waveform))
+        vocals = torch.Tensor(outputs["vocals"])[..., : waveform.shape[-1]]
+        return torch.nn.functional.pad(
+            vocals, (0, waveform.shape[-1] - vocals.shape[-1])
         )
-        self.pipeline = VocalRemoverPipeline(self.model)
 
     def __call__(self, waveform: torch.Tensor, sample_rate: int):
-        outputs = cast(dict[str, Any], self.pipeline(waveform))
-        return torch.Tensor(outputs["vocals"]), sample_rate
+        if self.segment is None:
+            return self._separate(waveform), sample_rate
+
+        length = waveform.shape[-1]
+        chunk_len = int(self.segment * sample_rate)
+        overlap_frames = min(int(self.overlap * sample_rate), chunk_len // 2)
+        hop = chunk_len - overlap_frames
+        num_chunks = max(1, math.ceil((length - overlap_frames) / hop))
+        padded_len = (num_chunks - 1) * hop + chunk_len
+        mix = torch.nn.functional.pad(waveform, (0, padded_len - length))
+        logger.info(
+            f"VocalRemoverSeparator: {num_chunks} segments on {self.workers} workers"
+        )
+
+        # linear crossfade: fade-in and fade-out of overlapping segments sum to 1
+        fade = torch.linspace(0, 1, overlap_frames + 2)[1:-1]
+        final = torch.zeros_like(mix)
+
+        def separate_chunk(k: int):
+            vocals = self._separate(mix[..., k * hop : k * hop + chunk_len])
+            if overlap_frames > 0:
+                if k > 0:
+                    vocals[..., :overlap_frames] *= fade
+                if k < num_chunks - 1:
+                    vocals[..., -overlap_frames:] *= fade.flip(0)
+            return k, vocals
+
+        def add(future: Future[tuple[int, torch.Tensor]]):
+            k, vocals = future.result()
+            final[..., k * hop : k * hop + chunk_len] += vocals
+
+        # at most `workers` segments in flight, whatever the song length
+        with ThreadPoolExecutor(self.workers) as executor:
+            running: set[Future[tuple[int, torch.Tensor]]] = set()
+            for k in range(num_chunks):
+                running.add(executor.submit(separate_chunk, k))
+                if len(running) >= self.workers:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        add(future)
+            for future in running:
+                add(future)
+
+        return final[..., :length], sample_rate
 
 
 class HybridDemucsSeparator(Separator):
@@ -159,49 +763,79 @@ class HybridDemucsSeparator(Separator):
     """
 
     bundle = HDEMUCS_HIGH_MUSDB_PLUS
+    # bump when the chunking (thus the output) changes, to invalidate cached tracks
+    chunking = "constant-hop-v2"
 
-    def __init__(self, segment=10.0, overlap=0.1):
+    def __init__(self, segment=10.0, overlap=0.1, batch_size=1, source="vocals"):
         super().__init__()
         self.segment = segment
         self.overlap = overlap
+        self.batch_size = batch_size
+        self.source = source
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # pyright: ignore[reportPrivateImportUsage]
 
-    def separate_sources(
-        self,
-        mix: torch.Tensor,
-        sample_rate: int,
-        model: torch.nn.Module,
-    ):
-        batch, channels, length = mix.shape
-
-        chunk_len = int(sample_rate * self.segment * (1 + self.overlap))
-        start = 0
-        end = chunk_len
-        overlap_frames = self.overlap * sample_rate
-        fade = Fade(
-            fade_in_len=0, fade_out_len=int(overlap_frames), fade_shape="linear"
+    @property
+    def identity(self):
+        return (
+            f"{type(self).__name__}(segment={self.segment}, overlap={self.overlap}, "
+            f"source={self.source}, chunking={self.chunking})"
         )
 
-        sources_list = cast(list[str], model.sources)
-        final = torch.zeros(  # pyright: ignore[reportPrivateImportUsage]
-            batch, len(sources_list), channels, length, device=self.device
-        )
+    @cached_property
+    def model(self) -> torch.nn.Module:
+        model = self.bundle.get_model()
+        model.to(self.device)
+        return model
+
+    def separate_sources(self, mix: torch.Tensor, sample_rate: int):
+        """(batch, channels, length) mix -> (batch, channels, length) self.source"""
+        batch, channels, length = mix.shape
 
-        while start < length - overlap_frames:
-            chunk = mix[:, :, start:end]
+        chunk_len = int(sample_rate * self.segment * (1 + self.overlap))
+        overlap_frames = int(self.overlap * sample_rate)
+        hop = chunk_len - overlap_frames
+        num_chunks = max(1, math.ceil((length - overlap_frames) / hop))
+        padded_len = (num_chunks - 1) * hop + chunk_len
+        chunks = torch.nn.functional.pad(mix, (0, padded_len - length)).unfold(
+            -1, chunk_len, hop
+        )  # (batch, channels, num_chunks, chunk_len) view
+
+        source_idx = cast(list[str], self.model.sources).index(self.source)
+
+        # linear crossfade: fade-in and fade-out of overlapping chunks sum to 1
+        fade = torch.linspace(0, 1, overlap_frames + 2, device=self.device)[1:-1]
+        window = torch.ones(chunk_len, device=self.device)
+        if overlap_frames > 0:
+            window[:overlap_frames] = fade
+            window[-overlap_frames:] = fade.flip(0)
+
+        final = torch.zeros(batch, channels, padded_len, device=self.device)  # pyright: ignore[reportPrivateImportUsage]
+
+        for k0 in range(0, num_chunks, self.batch_size):
+            k1 = min(k0 + self.batch_size, num_chunks)
+            n = k1 - k0
+            batch_chunks = chunks[:, :, k0:k1].permute(2, 0, 1, 3)
+            batch_chunks = batch_chunks.reshape(n * batch, channels, chunk_len)
             with torch.no_grad():
-                out = model.forward(chunk)
-            out = fade(out)
-            final[:, :, :, start:end] += out
-            if start == 0:
-                fade.fade_in_len = int(overlap_frames)
-                start += int(chunk_len - overlap_frames)
-            else:
-                start += chunk_len
-            end += chunk_len
-            if end >= length:
-                fade.fade_out_len = 0
-        return final
+                out = self.model.forward(batch_chunks.to(self.device))[:, source_idx]
+            # the first and last chunks are not faded at the edges of the song
+            weights = window.repeat(n, 1)
+            if overlap_frames > 0 and k0 == 0:
+                weights[0, :overlap_frames] = 1
+            if overlap_frames > 0 and k1 == num_chunks:
+                weights[-1, -overlap_frames:] = 1
+            out = out.reshape(n, batch, channels, chunk_len) * weights[:, None, None]
+            # overlap-add of the mini-batch chunks
+            out_len = (n - 1) * hop + chunk_len
+            out = torch.nn.functional.fold(
+                out.permute(1, 2, 3, 0).reshape(batch, channels * chunk_len, n),
+                output_size=(1, out_len),
+                kernel_size=(1, chunk_len),
+                stride=(1, hop),
+            )
+            final[:, :, k0 * hop : k0 * hop + out_len] += out[:, :, 0]
+
+        return final[:, :, :length]
 
     def __call__(self, waveform: torch.Tensor, sample_rate: int):
         logger.info(f"HybridDemucsSeparator: running on {self.device=}")
@@ -212,18 +846,10 @@ class HybridDemucsSeparator(Separator):
         )
         waveform = waveform.to(self.device)
 
-        model = self.bundle.get_model()
-        model.to(self.device)
-
         ref = waveform.mean(0)
         waveform = (waveform - ref.mean()) / ref.std()  # normalization
 
-        sources = self.separate_sources(waveform[None], sample_rate, model)[0]
-        sources = sources * ref.std() + ref.mean()
-
-        sources_list = cast(list[str], model.sources)
-        sources = list(sources)
-
-        audios = dict(zip(sources_list, sources))
+        vocals = self.separate_sources(waveform[None], sample_rate)[0]
+        vocals = vocals * ref.std() + ref.mean()
 
-        return audios["vocals"], sample_rate
+        return vocals, sample_rate
@@ -0,0 +1,135 @@
+import logging
+import os
+import tempfile
+import threading
+from collections.abc import Callable
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
+# torch is imported lazily so that the CLI can list the backends without it
+# (waveforms, lengths of the padded waveforms or None) -> emission
+EmissionFn = Callable[["torch.Tensor", "torch.Tensor | None"], "torch.Tensor"]
+
+
+class InferenceBackend(str, Enum):
+    Eager = "eager"
+    Int8 = "int8"  # dynamic int8 quantization of the linear layers (CPU)
+    Compile = "compile"  # torch.compile
+    BF16 = "bf16"  # bfloat16 autocast
+    ONNX = "onnx"  # ONNX Runtime (CPU)
+
+
+def apply_backend(
+    module: "torch.nn.Module",
+    backend: InferenceBackend,
+    device: "torch.device",
+    onnx_file: Path | None = None,
+) -> EmissionFn:
+    """
+    Wrap a module mapping (batch, samples) waveforms and their optional lengths to
+    (batch, frames, vocab) log-probs so that it runs with the given inference backend.
+
+    The ONNX export is kept in `onnx_file` for the next runs, or only for the
+    session if None.
+    """
+    import torch
+
+    module.eval()
+    match backend:
+        case InferenceBackend.Eager:
+            return lambda waveforms, lengths: module(
+                waveforms.to(device), _to(lengths, device)
+            )
+
+        case InferenceBackend.Int8:
+            cpu = torch.device("cpu")
+            quantized = torch.ao.quantization.quantize_dynamic(  # pyright: ignore[reportDeprecated]
+                module.to(cpu), {torch.nn.Linear}, dtype=torch.qint8
+            )
+            return lambda waveforms, lengths: quantized(
+                waveforms.to(cpu), _to(lengths, cpu)
+            )
+
+        case InferenceBackend.Compile:
+            compiled = torch.compile(module, dynamic=True)
+            return lambda waveforms, lengths: compiled(
+                waveforms.to(device), _to(lengths, device)
+            )
+
+        case InferenceBackend.BF16:
+
+            def run_bf16(waveforms: torch.Tensor, lengths: torch.Tensor | None):
+                with torch.autocast(device.type, dtype=torch.bfloat16):
+                    return module(waveforms.to(device), _to(lengths, device)).float()
+
+            return run_bf16
+
+        case InferenceBackend.ONNX:
+            return _onnx_runner(module, onnx_file)
+
+
+def _onnx_runner(module: "torch.nn.Module", onnx_file: Path | None) -> EmissionFn:
+    import onnxruntime  # pyright: ignore[reportMissingImports]
+    import torch
+
+    if onnx_file is None:
+        # the session holds the model once created, the export can be deleted
+        with tempfile.TemporaryDirectory(prefix="yohane-onnx-") as tmp_dir:
+            tmp_file = Path(tmp_dir) / "model.onnx"
+            _export_onnx(module, tmp_file)
+            session = onnxruntime.InferenceSession(
+                tmp_file.as_posix(), providers=["CPUExecutionProvider"]
+            )
+    else:
+        if not onnx_file.is_file():
+            onnx_file.parent.mkdir(parents=True, exist_ok=True)
+            # unique per writer so that concurrent exports do not clobber each other
+            writer = f"{os.getpid()}.{threading.get_ident()}"
+            tmp_file = onnx_file.with_name(f"{onnx_file.name}.{writer}.tmp")
+            _export_onnx(module, tmp_file)
+            tmp_file.replace(onnx_file)
+        session = onnxruntime.InferenceSession(
+            onnx_file.as_posix(), providers=["CPUExecutionProvider"]
+        )
+
+    def run(waveforms: torch.Tensor):
+        inputs = {"waveforms": waveforms.detach().cpu().float().numpy()}
+        (emission,) = session.run(["emission"], inputs)
+        return torch.from_numpy(emission)
+
+    def run_onnx(waveforms: torch.Tensor, lengths: torch.Tensor | None):
+        if lengths is None:
+            return run(waveforms)
+        # the exported graph has no padding mask: run each waveform on its own
+        emissions = [run(w[None, :n])[0] for w, n in zip(waveforms, lengths.tolist())]
+        return torch.nn.utils.rnn.pad_sequence(emissions, batch_first=True)
+
+    return run_onnx
+
+
+def _export_onnx(module: "torch.nn.Module", onnx_file: Path):
+    import torch
+
+    logger.info(f"Exporting model to '{onnx_file.as_posix()}'")
+    torch.onnx.export(
+        module.cpu(),
+        (torch.zeros(1, 16000),),
+        onnx_file.as_posix(),
+        input_names=["waveforms"],
+        output_names=["emission"],
+        dynamic_axes={
+            "waveforms": {0: "batch", 1: "samples"},
+            "emission": {0: "batch", 1: "frames"},
+        },
+        dynamo=False,
+    )
+
+
+def _to(tensor: "torch.Tensor | None", device: "torch.device"):
+    return tensor.to(device) if tensor is not None else None
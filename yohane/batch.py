@@ -0,0 +1,114 @@
+import logging
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+
+from pysubs2 import SSAFile
+
+from yohane.pipeline import Yohane, batch_emissions
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchJob:
+    song_file: Path
+    lyrics: str
+    output: Path
+    checkpoint_dir: Path | None = None
+
+
+@dataclass
+class BatchResult:
+    job: BatchJob
+    subs: SSAFile | None = None
+    error: Exception | None = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def run_batch(
+    yohane: Yohane,
+    jobs: Iterable[BatchJob],
+    *,
+    after_separation: Callable[[Yohane, BatchJob], None] | None = None,
+    align_batch_size: int = 1,
+) -> Iterator[BatchResult]:
+    """
+    Run the full pipeline over every job, reusing the models loaded by `yohane`.
+
+    A failing job is reported in its `BatchResult` and does not stop the run.
+    With `align_batch_size` > 1, the songs are aligned by groups of that size which
+    share the forward passes of the forced aligner model.
+    """
+    if align_batch_size > 1:
+        yield from _run_grouped_batch(yohane, jobs, after_separation, align_batch_size)
+        return
+
+    for job in jobs:
+        yohane.reset()
+        try:
+            _prepare(yohane, job, after_separation)
+            yohane.force_align()
+            yohane.release("song", "vocals")
+            subs = yohane.make_subs()
+        except Exception as e:
+            logger.exception(f"Failed to process '{job.song_file.as_posix()}'")
+            yield BatchResult(job, error=e)
+        else:
+            yield BatchResult(job, subs=subs)
+        finally:
+            yohane.reset()
+
+
+def _run_grouped_batch(
+    yohane: Yohane,
+    jobs: Iterable[BatchJob],
+    after_separation: Callable[[Yohane, BatchJob], None] | None,
+    align_batch_size: int,
+):
+    jobs_iter = iter(jobs)
+    while group := list(islice(jobs_iter, align_batch_size)):
+        prepared: list[tuple[BatchJob, Yohane]] = []
+        for job in group:
+            song = yohane.for_song()
+            try:
+                _prepare(song, job, after_separation)
+            except Exception as e:
+                logger.exception(f"Failed to process '{job.song_file.as_posix()}'")
+                yield BatchResult(job, error=e)
+            else:
+                prepared.append((job, song))
+
+        emissions = batch_emissions([song for _, song in prepared], align_batch_size)
+        for (job, song), emission in zip(prepared, emissions):
+            try:
+                song.force_align(emission)
+                song.release("song", "vocals")
+                subs = song.make_subs()
+            except Exception as e:
+                logger.exception(f"Failed to process '{job.song_file.as_posix()}'")
+                yield BatchResult(job, error=e)
+            else:
+                yield BatchResult(job, subs=subs)
+            finally:
+                song.reset()
+
+
+def _prepare(
+    yohane: Yohane,
+    job: BatchJob,
+    after_separation: Callable[[Yohane, BatchJob], None] | None,
+):
+    """Every stage up to the forced alignment"""
+    logger.info(f"Processing '{job.song_file.as_posix()}'")
+    if job.checkpoint_dir is not None:
+        yohane.resume_from(job.checkpoint_dir)
+    yohane.load_song(job.song_file)
+    yohane.load_lyrics(job.lyrics)
+    yohane.extract_vocals()
+    if after_separation is not None:
+        after_separation(yohane, job)
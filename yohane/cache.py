@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10 * 1024**3  # 10 GiB
+
+
+def hash_waveform(waveform: torch.Tensor, sample_rate: int):
+    waveform = waveform.detach().cpu().contiguous()
+    h = hashlib.sha256()
+    h.update(f"{sample_rate}:{tuple(waveform.shape)}:{waveform.dtype}".encode())
+    h.update(waveform.numpy().data)
+    return h.hexdigest()
+
+
+def cache_key(*parts: str):
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Content-addressed on-disk cache of tensors.
+
+    Tensors are stored as .npy files so they can be memory-mapped back, along with
+    a .json metadata sidecar. Least recently used entries are evicted once the
+    directory grows over `max_size` bytes (see `evict`).
+    """
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, key: str):
+        return self.directory / f"{key}.npy", self.directory / f"{key}.json"
+
+    def load(self, key: str) -> tuple[torch.Tensor, dict[str, Any]] | None:
+        data_path, meta_path = self._paths(key)
+        try:
+            metadata = json.loads(meta_path.read_text())
+            array = np.load(data_path, mmap_mode="c")
+        except (OSError, ValueError):
+            return None
+        data_path.touch()  # mark as recently used
+        logger.debug(f"Cache hit for {key}")
+        return torch.from_numpy(array), metadata
+
+    def save(self, key: str, tensor: torch.Tensor, **metadata: Any):
+        data_path, meta_path = self._paths(key)
+        # write to temporary files first so that readers never see partial entries
+        writer = f"{os.getpid()}.{threading.get_ident()}"
+        tmp_data_path = data_path.with_name(f"{data_path.name}.{writer}.tmp")
+        tmp_meta_path = meta_path.with_name(f"{meta_path.name}.{writer}.tmp")
+        with tmp_data_path.open("wb") as f:
+            np.save(f, tensor.detach().cpu().numpy())
+        tmp_meta_path.write_text(json.dumps(metadata))
+        os.replace(tmp_data_path, data_path)
+        os.replace(tmp_meta_path, meta_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Evict the least recently used entries until the whole directory, including
+        its subdirectories, fits in `max_size`. Any files named like a .json sidecar
+        up to their suffix form an entry, so that other files can be kept in the
+        cache with the same eviction (e.g. downloads). The files without a sidecar
+        only count towards the size.
+        """
+        files: defaultdict[Path, list[tuple[Path, os.stat_result]]] = defaultdict(list)
+        for path in self.directory.rglob("*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.is_file():
+                files[path.with_suffix("")].append((path, stat))
+
+        total_size = 0
+        entries: list[tuple[float, int, list[Path]]] = []
+        for entry_files in files.values():
+            size = sum(stat.st_size for _, stat in entry_files)
+            total_size += size
+            paths = [path for path, _ in entry_files]
+            if any(path.suffix == ".json" for path in paths):
+                mtime = max(stat.st_mtime for _, stat in entry_files)
+                entries.append((mtime, size, paths))
+
+        for _, size, paths in sorted(entries, key=lambda entry: entry[0]):
+            if total_size <= self.max_size:
+                break
+            logger.debug(f"Evicting {paths[0].with_suffix('')} from cache")
+            # the sidecar first so that the entry is never found half evicted
+            for path in sorted(paths, key=lambda path: path.suffix != ".json"):
+                path.unlink(missing_ok=True)
+            total_size -= size
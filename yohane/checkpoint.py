@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import numpy as np
+import torch
+from pysubs2 import SSAFile
+
+logger = logging.getLogger(__name__)
+
+# in pipeline order: a stage key depends on the keys of the stages before it
+STAGES = ["song", "vocals", "emission", "spans", "subs"]
+
+
+class Checkpoint:
+    """
+    Directory holding the artifact of each stage of a single job, to resume it.
+
+    A manifest records the key (hash of the inputs and parameters) each artifact was
+    computed from. An artifact is only restored if its key matches the current one,
+    and saving a stage with a new key invalidates the stages downstream of it.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._manifest_path = directory / "manifest.json"
+        try:
+            self.manifest: dict[str, str] = json.loads(self._manifest_path.read_text())
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def _valid(self, stage: str, key: str):
+        return self.manifest.get(stage) == key
+
+    def load_tensor(
+        self, stage: str, key: str
+    ) -> tuple[torch.Tensor, dict[str, Any]] | None:
+        if not self._valid(stage, key):
+            return None
+        try:
+            array = np.load(self.directory / f"{stage}.npy", mmap_mode="c")
+            metadata = json.loads((self.directory / f"{stage}.json").read_text())
+        except (OSError, ValueError):
+            return None
+        return torch.from_numpy(array), metadata
+
+    def save_tensor(self, stage: str, key: str, tensor: torch.Tensor, **metadata: Any):
+        with self._writer(stage, ".npy") as f:
+            np.save(f, tensor.detach().cpu().numpy())
+        with self._writer(stage, ".json") as f:
+            f.write(json.dumps(metadata).encode())
+        self._commit(stage, key)
+
+    def load_json(self, stage: str, key: str) -> Any | None:
+        if not self._valid(stage, key):
+            return None
+        try:
+            return json.loads((self.directory / f"{stage}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def save_json(self, stage: str, key: str, data: Any):
+        with self._writer(stage, ".json") as f:
+            f.write(json.dumps(data).encode())
+        self._commit(stage, key)
+
+    def load_subs(self, stage: str, key: str) -> SSAFile | None:
+        if not self._valid(stage, key):
+            return None
+        try:
+            return SSAFile.from_string((self.directory / f"{stage}.ass").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def save_subs(self, stage: str, key: str, subs: SSAFile):
+        with self._writer(stage, ".ass") as f:
+            f.write(subs.to_string("ass").encode())
+        self._commit(stage, key)
+
+    @contextmanager
+    def _writer(self, stage: str, suffix: str) -> Generator[BinaryIO]:
+        if self.manifest.pop(stage, None) is not None:
+            self._save_manifest()  # never pair the old key with a partial artifact
+        path = self.directory / f"{stage}{suffix}"
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("wb") as f:
+                yield f
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _commit(self, stage: str, key: str):
+        # the downstream artifacts were computed from the previous artifact
+        for name in STAGES[STAGES.index(stage) + 1 :]:
+            if self.manifest.pop(name, None) is not None:
+                logger.debug(f"Checkpoint of {name} invalidated")
+        self.manifest[stage] = key
+        self._save_manifest()
+
+    def _save_manifest(self):
+        tmp_path = self._manifest_path.with_name(f"manifest.json.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(self.manifest, indent=2))
+        os.replace(tmp_path, self._manifest_path)
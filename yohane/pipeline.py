@@ -1,52 +1,230 @@
+import copy
 import logging
+from difflib import SequenceMatcher
+from functools import partial
 from pathlib import Path
+from typing import Any
 
 import torch
-from torchaudio.functional import TokenSpan, resample
+from pysubs2 import SSAEvent, SSAFile
+from torchaudio.functional import TokenSpan
 from torchcodec.decoders._audio_decoder import AudioDecoder
 
+from yohane.alignment import ForcedAlignment
 from yohane.audio import (
     ForcedAligner,
+    GatingReport,
     Separator,
     TorchAudioForcedAligner,
+    VoiceActivityGate,
     Wav2Vec2ForcedAligner,
 )
+from yohane.cache import ArtifactCache, cache_key, hash_waveform
+from yohane.checkpoint import Checkpoint
 from yohane.lyrics import Lyrics
-from yohane.subtitles import make_ass
+from yohane.profiling import NullProfiler
+from yohane.resampling import resample
+from yohane.shared import SharedArtifacts, SharedTensor
+from yohane.streaming import iter_separated_blocks, iter_song_blocks
+from yohane.subtitles import make_ass, read_timed_lines
+from yohane.tokens import TokenPlan
 
 logger = logging.getLogger(__name__)
 
 
+def get_forced_aligner(
+    forced_aligner: str | ForcedAligner | None = None, **kwargs: Any
+) -> ForcedAligner:
+    if isinstance(forced_aligner, ForcedAligner):
+        return forced_aligner
+    if forced_aligner is not None:
+        return Wav2Vec2ForcedAligner(forced_aligner, **kwargs)
+    return TorchAudioForcedAligner(**kwargs)
+
+
 class Yohane:
     def __init__(
         self,
         *,
         separator: Separator | None,
-        forced_aligner: str | None = None,
+        forced_aligner: str | ForcedAligner | None = None,
+        cache: ArtifactCache | None = None,
+        gate: VoiceActivityGate | None = None,
+        hierarchical: bool = False,
+        profiler: NullProfiler | None = None,
+        cache_song: bool = False,
     ):
         self.separator = separator
-        self.forced_aligner: ForcedAligner = (
-            Wav2Vec2ForcedAligner(forced_aligner)
-            if forced_aligner is not None
-            else TorchAudioForcedAligner()
-        )
+        self.profiler = profiler if profiler is not None else NullProfiler()
+        self.cache = cache
+        self.gate = gate
+        self.hierarchical = hierarchical
+        # decoded songs are large and cheap to decode again, so they are only cached
+        # if they are expected to be reused (e.g. by a server re-timing edits)
+        self.cache_song = cache_song
+        self.forced_aligner = get_forced_aligner(forced_aligner)
         self.song: tuple[torch.Tensor, int] | None = None
         self.vocals: tuple[torch.Tensor, int] | None = None
         self.lyrics: Lyrics | None = None
-        self.forced_alignment: tuple[torch.Tensor, list[list[TokenSpan]]] | None = None
+        self.forced_alignment: ForcedAlignment | None = None
+        self.gating_report: GatingReport | None = None
+        self.checkpoint: Checkpoint | None = None
+        self._song_digest: str | None = None
+        self._vocals_digest: str | None = None
+        self._spans_key: str | None = None
+        # views of shared buffers and their handles, released on reset
+        self._shared: list[tuple[torch.Tensor, SharedTensor]] = []
+
+    def reset(self):
+        """Forget the per-song state, keeping the loaded models."""
+        self.song = None
+        self.vocals = None
+        self.lyrics = None
+        self.forced_alignment = None
+        self.gating_report = None
+        self.checkpoint = None
+        self._song_digest = None
+        self._vocals_digest = None
+        self._spans_key = None
+        for _, handle in self._shared:
+            handle.release()
+        self._shared = []
+
+    def for_song(self):
+        """Copy sharing the models, cache and profiler, to process another song concurrently."""
+        yohane = copy.copy(self)
+        yohane._shared = []
+        yohane.reset()
+        return yohane
+
+    @property
+    def song_digest(self):
+        if self._song_digest is None:
+            assert self.song is not None
+            self._song_digest = hash_waveform(*self.song)
+        return self._song_digest
+
+    @property
+    def vocals_digest(self):
+        if self._vocals_digest is None:
+            assert self.vocals is not None
+            self._vocals_digest = hash_waveform(*self.vocals)
+        return self._vocals_digest
+
+    @property
+    def forced_aligned_audio_digest(self):
+        return self.vocals_digest if self.vocals is not None else self.song_digest
 
     @property
     def forced_aligned_audio(self):
         return self.vocals if self.vocals is not None else self.song
 
+    def resume_from(self, directory: Path):
+        """Restore the stages already done for the song, and checkpoint the next ones"""
+        self.checkpoint = Checkpoint(directory)
+
+    def share(self, directory: Path | None = None):
+        """
+        Handles to the song, vocals and forced alignment in shared memory, to hand
+        them to another process (see `load_shared`) without copying the buffers.
+        The handles which were not claimed are released when this process exits.
+        """
+
+        def handle(tensor: torch.Tensor):
+            for shared_tensor, shared in self._shared:
+                if shared_tensor is tensor:
+                    return shared.ref()
+            shared = SharedTensor.create(tensor, directory)
+            self._shared.append((tensor, shared))
+            return shared.ref()
+
+        artifacts = SharedArtifacts()
+        if self.song is not None:
+            artifacts.song = (handle(self.song[0]), self.song[1])
+            artifacts.song_digest = self._song_digest
+        if self.vocals is not None:
+            artifacts.vocals = (handle(self.vocals[0]), self.vocals[1])
+            artifacts.vocals_digest = self._vocals_digest
+        artifacts.forced_alignment = self.forced_alignment
+        return artifacts
+
+    def load_shared(self, artifacts: SharedArtifacts):
+        """
+        Continue with the artifacts shared by another process, as views of the same
+        buffers. The handles are claimed by this instance, which releases them on
+        `reset` or `release` (or when the process exits).
+        """
+
+        def view(handle: SharedTensor):
+            handle = handle.claim()
+            tensor = handle.tensor()
+            self._shared.append((tensor, handle))
+            return tensor
+
+        if artifacts.song is not None:
+            self.song = (view(artifacts.song[0]), artifacts.song[1])
+            self._song_digest = artifacts.song_digest
+        if artifacts.vocals is not None:
+            self.vocals = (view(artifacts.vocals[0]), artifacts.vocals[1])
+            self._vocals_digest = artifacts.vocals_digest
+        if artifacts.forced_alignment is not None:
+            self.forced_alignment = artifacts.forced_alignment
+
     def load_song(self, song_file: Path):
+        """
+        Decode the song into `song`. Without a separator, the song is only used by
+        the forced aligner, so it is decoded straight to a mono waveform at the
+        sample rate of the aligner instead of its native layout and rate.
+        """
         logger.info("Loading song")
-        audio = AudioDecoder(song_file.as_posix())
+        with self.profiler.stage("load_song") as stage:
+            self._load_song(song_file)
+            assert self.song is not None
+            stage.tensor("song", self.song[0])
+
+    def _load_song(self, song_file: Path):
+        # decode straight to what the forced aligner needs if there is no separation
+        decoding = (
+            "native"
+            if self.separator is not None
+            else f"mono@{self.forced_aligner.sample_rate}"
+        )
+        stat = song_file.stat()
+        key = cache_key(
+            "song",
+            song_file.resolve().as_posix(),
+            str(stat.st_size),
+            str(stat.st_mtime_ns),
+            decoding,
+        )
+        if (restored := self._restore("song", key, cache=self.cache_song)) is not None:
+            waveform, metadata = restored
+            self.song = (waveform, metadata["sample_rate"])
+            self._song_digest = metadata["digest"]
+            return
+
+        if self.separator is None:
+            audio = AudioDecoder(
+                song_file.as_posix(),
+                sample_rate=self.forced_aligner.sample_rate,
+                num_channels=1,
+            )
+        else:
+            audio = AudioDecoder(song_file.as_posix())
         samples = audio.get_all_samples()
         waveform = samples.data
         if waveform.size(0) > 2:
             waveform = waveform.mean(dim=0, keepdim=True).repeat(2, 1)
         self.song = (waveform, samples.sample_rate)
+        self._song_digest = None
+        self._store(
+            "song",
+            key,
+            waveform,
+            cache=self.cache_song,
+            sample_rate=samples.sample_rate,
+            digest=self.song_digest,
+        )
 
     def extract_vocals(self):
         if self.separator is None:
@@ -55,9 +233,65 @@ class Yohane:
                 'Use the "--separator" flag to specify one.'
             )
             return
-        logger.info(f"Extracting vocals with {self.separator=}")
+        with self.profiler.stage("extract_vocals") as stage:
+            self._extract_vocals(self.separator)
+            assert self.vocals is not None
+            stage.tensor("vocals", self.vocals[0])
+
+    def _extract_vocals(self, separator: Separator):
         assert self.song
-        self.vocals = self.separator(*self.song)
+        # the vocals are fully determined by the song and the separator
+        key = cache_key("vocals", self.song_digest, separator.identity)
+        if (restored := self._restore("vocals", key)) is not None:
+            waveform, metadata = restored
+            self.vocals = (waveform, metadata["sample_rate"])
+        else:
+            logger.info(f"Extracting vocals with {separator=}")
+            self.vocals = separator(*self.song)
+            waveform, sample_rate = self.vocals
+            self._store("vocals", key, waveform, sample_rate=sample_rate)
+        self._vocals_digest = key
+
+    def _restore(self, stage: str, key: str, *, cache: bool = True):
+        """Artifact of a stage from the checkpoint, or else from the cache"""
+        if self.checkpoint is not None and (
+            restored := self.checkpoint.load_tensor(stage, key)
+        ):
+            logger.info(f"{stage.capitalize()} restored from checkpoint")
+            return restored
+        if cache and self.cache is not None and (restored := self.cache.load(key)):
+            logger.info(f"{stage.capitalize()} loaded from cache")
+            if self.checkpoint is not None:
+                self.checkpoint.save_tensor(stage, key, restored[0], **restored[1])
+            return restored
+        return None
+
+    def _store(
+        self,
+        stage: str,
+        key: str,
+        tensor: torch.Tensor,
+        *,
+        cache: bool = True,
+        **metadata: Any,
+    ):
+        if self.checkpoint is not None:
+            self.checkpoint.save_tensor(stage, key, tensor, **metadata)
+        if cache and self.cache is not None:
+            self.cache.save(key, tensor, **metadata)
+
+    def stream_separated(
+        self, song_file: Path, block_length: float = 30.0, context: float = 5.0
+    ):
+        """
+        Decode and separate the song block by block, yielding
+        (vocals, off_vocal, sample_rate) blocks at the song sample rate.
+        Memory usage is bounded by the block length instead of the song duration.
+        """
+        assert self.separator is not None
+        logger.info(f"Streaming vocals extraction with {self.separator=}")
+        blocks = iter_song_blocks(song_file, block_length)
+        return iter_separated_blocks(self.separator, blocks, context)
 
     def extract_off_vocal(self):
         if self.song is None or self.vocals is None:
@@ -76,25 +310,281 @@ class Yohane:
         logger.info("Loading lyrics")
         self.lyrics = Lyrics(lyrics_str)
 
-    def force_align(self):
+    @property
+    def token_plan(self):
+        assert self.lyrics is not None
+        return TokenPlan.from_lyrics(self.lyrics, self.forced_aligner)
+
+    def force_align(self, emission: torch.Tensor | None = None):
+        """`emission` of the whole audio if already computed, see `batch_emissions`"""
         logger.info("Computing forced alignment")
         assert self.forced_aligned_audio is not None and self.lyrics is not None
-        tokens = self.forced_aligner.tokenize(self.lyrics.transcript)
-        self.forced_alignment = self.forced_aligner.align(
-            tokens, *self.forced_aligned_audio
+        waveform, sample_rate = self.forced_aligned_audio
+        with self.profiler.stage("tokenize"):
+            tokens = self.token_plan.tokens
+        align_fn = self.forced_aligner.align_emission
+        if self.hierarchical:
+            align_fn = partial(
+                self.forced_aligner.align_emission_hierarchical,
+                line_lengths=[len(line.words) for line in self.lyrics.lines],
+            )
+
+        with self.profiler.stage("emission") as stage:
+            regions = None
+            if self.gate is not None:
+                regions = self.gate(waveform, sample_rate)
+                self.gating_report = GatingReport(
+                    waveform.size(1) / sample_rate, regions
+                )
+                logger.info(f"Voice activity gating: {self.gating_report}")
+            if emission is None:
+                emission = self.compute_emission(regions)
+            elif regions is not None:
+                raise ValueError("The emission of a gated song is computed on its own")
+            stage.tensor("waveform", waveform)
+            stage.tensor("emission", emission)
+
+        self._spans_key = cache_key(
+            "spans",
+            self._emission_key(regions),
+            self.lyrics.raw,
+            f"hierarchical={self.hierarchical}",
         )
+        if self.checkpoint is not None and (
+            restored := self.checkpoint.load_json("spans", self._spans_key)
+        ):
+            logger.info("Spans restored from checkpoint")
+            token_spans = [[TokenSpan(*span) for span in spans] for spans in restored]
+            self.forced_alignment = self._compact(token_spans, emission)
+            return
+
+        with self.profiler.stage("trellis"):
+            if regions is None:
+                token_spans = align_fn(tokens, emission[0])
+            else:
+                voiced = self.forced_aligner.voiced_frames(
+                    regions, waveform.size(1), sample_rate
+                )
+                token_spans = self.forced_aligner.align_voiced_emission(
+                    tokens, emission[0], voiced, align_fn
+                )
+        self.forced_alignment = self._compact(token_spans, emission)
+        if self.checkpoint is not None:
+            self.checkpoint.save_json(
+                "spans",
+                self._spans_key,
+                [
+                    [[span.token, span.start, span.end, span.score] for span in spans]
+                    for spans in token_spans
+                ],
+            )
+
+    def _compact(self, token_spans: list[list[TokenSpan]], emission: torch.Tensor):
+        assert self.forced_aligned_audio is not None
+        waveform, sample_rate = self.forced_aligned_audio
+        return ForcedAlignment.from_spans(
+            token_spans,
+            emission,
+            waveform.size(1),
+            sample_rate,
+        )
+
+    def release(self, *artifacts: str):
+        """
+        Drop the large intermediates ("song", "vocals") which the next stages do
+        not need, e.g. the waveforms once the tracks are saved and the lyrics
+        aligned: `make_subs` only needs the compact forced alignment.
+        """
+        dropped: list[torch.Tensor] = []
+        for artifact in artifacts:
+            match artifact:
+                case "song":
+                    if self.song is not None:
+                        dropped.append(self.song[0])
+                    self.song = None
+                case "vocals":
+                    if self.vocals is not None:
+                        dropped.append(self.vocals[0])
+                    self.vocals = None
+                case _:
+                    raise ValueError(f"Unknown artifact: {artifact}")
+
+        shared: list[tuple[torch.Tensor, SharedTensor]] = []
+        for tensor, handle in self._shared:
+            if any(tensor is t for t in dropped):
+                handle.release()
+            else:
+                shared.append((tensor, handle))
+        self._shared = shared
+
+    def compute_emission(
+        self, regions: list[tuple[float, float]] | None = None
+    ) -> torch.Tensor:
+        assert self.forced_aligned_audio is not None
+        key = self._emission_key(regions)
+        if (restored := self._restore("emission", key)) is not None:
+            emission, _ = restored
+            return emission
+        emission = self.forced_aligner.emission(*self.forced_aligned_audio, regions)
+        self._store("emission", key, emission)
+        return emission
+
+    def _emission_key(self, regions: list[tuple[float, float]] | None):
+        key_parts = [
+            "emission",
+            self.forced_aligned_audio_digest,
+            self.forced_aligner.identity,
+        ]
+        if regions is not None:
+            key_parts.append(repr(regions))
+        return cache_key(*key_parts)
 
     def make_subs(self):
         logger.info("Generating .ass")
-        assert (
-            self.lyrics is not None
-            and self.forced_aligned_audio is not None
-            and self.forced_alignment is not None
-        )
-        subs = make_ass(
-            self.lyrics,
-            *self.forced_aligned_audio,
-            self.forced_aligner.tokenize,
-            *self.forced_alignment,
+        assert self.lyrics is not None and self.forced_alignment is not None
+        subs_key = None
+        if self.checkpoint is not None and self._spans_key is not None:
+            subs_key = cache_key("subs", self._spans_key)
+            if (restored := self.checkpoint.load_subs("subs", subs_key)) is not None:
+                logger.info("Subs restored from checkpoint")
+                return restored
+        with self.profiler.stage("make_subs"):
+            subs = make_ass(self.lyrics, self.token_plan, self.forced_alignment)
+        if self.checkpoint is not None and subs_key is not None:
+            self.checkpoint.save_subs("subs", subs_key, subs)
+        return subs
+
+    def realign_subs(self, previous: SSAFile):
+        """
+        Re-time only the lines of `previous` (made by `make_subs`) which differ
+        from the current lyrics, within the time window left by their unchanged
+        neighbours. The events of unchanged lines are kept as is.
+        """
+        logger.info("Re-aligning edited lines")
+        assert self.lyrics is not None and self.forced_aligned_audio is not None
+        waveform, sample_rate = self.forced_aligned_audio
+        duration = round(waveform.size(1) * 1000 / sample_rate)  # ms
+
+        timed_lines = read_timed_lines(previous)
+        new_lines = [line.raw for line in self.lyrics.lines]
+        kept: list[tuple[SSAEvent, SSAEvent] | None] = [None] * len(new_lines)
+        matcher = SequenceMatcher(
+            a=[comment.text for comment, _ in timed_lines], b=new_lines, autojunk=False
         )
+        for match in matcher.get_matching_blocks():
+            for k in range(match.size):
+                kept[match.b + k] = timed_lines[match.a + k]
+
+        realigned: dict[tuple[int, int], list[SSAEvent]] = {}
+        while blocks := [b for b in _changed_blocks(kept) if b not in realigned]:
+            j1, j2 = blocks[0]
+            start = _timed_line_end(kept[j1 - 1]) if j1 > 0 else 0
+            end = _timed_line_start(kept[j2]) if j2 < len(kept) else duration
+            try:
+                realigned[(j1, j2)] = self._align_lines(new_lines[j1:j2], start, end)
+            except RuntimeError:
+                if j1 == 0 and j2 == len(kept):
+                    raise
+                # not enough room between the neighbours: re-align them as well
+                logger.info(f"Widening re-alignment of lines {j1}-{j2}")
+                kept[max(j1 - 1, 0)] = None
+                kept[min(j2, len(kept) - 1)] = None
+
+        subs = copy.copy(previous)
+        subs.events = []
+        blocks = dict(_changed_blocks(kept))
+        j = 0
+        while j < len(kept):
+            if (timed_line := kept[j]) is not None:
+                subs.extend(timed_line)
+                j += 1
+            else:
+                subs.extend(realigned[(j, blocks[j])])
+                j = blocks[j]
         return subs
+
+    def _align_lines(self, lines: list[str], start: int, end: int):
+        assert self.forced_aligned_audio is not None
+        waveform, sample_rate = self.forced_aligned_audio
+        window = waveform[:, start * sample_rate // 1000 : end * sample_rate // 1000]
+        if window.size(1) < sample_rate // 10:
+            raise RuntimeError("Not enough audio to align the edited lines")
+
+        lyrics = Lyrics("\n".join(lines))
+        token_plan = TokenPlan.from_lyrics(lyrics, self.forced_aligner)
+        tokens = token_plan.tokens
+        emission = self.forced_aligner.emission(window, sample_rate)
+        if emission.size(1) < sum(len(seq) for seq in tokens):
+            raise RuntimeError("Not enough audio to align the edited lines")
+        token_spans = self.forced_aligner.align_emission(tokens, emission[0])
+        alignment = ForcedAlignment.from_spans(
+            token_spans, emission, window.size(1), sample_rate
+        )
+
+        subs = make_ass(lyrics, token_plan, alignment)
+        subs.shift(ms=start)
+        return subs.events
+
+
+def batch_emissions(
+    songs: list[Yohane], batch_size: int = 4
+) -> list[torch.Tensor | None]:
+    """
+    Emissions to `force_align` several songs sharing the same forced aligner (see
+    `for_song`) with, computed in batched forward passes of the model. None for the
+    songs which compute theirs on their own: gated songs, or all the uncached ones
+    if the batched passes failed.
+    """
+    emissions: list[torch.Tensor | None] = [None] * len(songs)
+    pending: list[int] = []
+    for i, song in enumerate(songs):
+        if song.gate is not None:
+            continue  # the model only runs on its voiced regions
+        restored = song._restore("emission", song._emission_key(None))
+        if restored is not None:
+            emissions[i] = restored[0]
+        else:
+            pending.append(i)
+
+    if pending:
+        aligner = songs[pending[0]].forced_aligner
+        assert all(songs[i].forced_aligner is aligner for i in pending)
+        audios: list[tuple[torch.Tensor, int]] = []
+        for i in pending:
+            audio = songs[i].forced_aligned_audio
+            assert audio is not None
+            audios.append(audio)
+        try:
+            with songs[pending[0]].profiler.stage("emission_batch") as stage:
+                batched = aligner.emission_batch(audios, batch_size)
+                for i, emission in zip(pending, batched):
+                    songs[i]._store("emission", songs[i]._emission_key(None), emission)
+                    emissions[i] = emission
+                    stage.tensor(f"emission[{i}]", emission)
+        except Exception:
+            logger.exception("Batched emission failed, computing it song by song")
+    return emissions
+
+
+def _changed_blocks(kept: list[tuple[SSAEvent, SSAEvent] | None]):
+    blocks: list[tuple[int, int]] = []
+    j = 0
+    while j < len(kept):
+        if kept[j] is None:
+            j1 = j
+            while j < len(kept) and kept[j] is None:
+                j += 1
+            blocks.append((j1, j))
+        else:
+            j += 1
+    return blocks
+
+
+def _timed_line_start(timed_line: tuple[SSAEvent, SSAEvent] | None):
+    assert timed_line is not None
+    return timed_line[1].start
+
+
+def _timed_line_end(timed_line: tuple[SSAEvent, SSAEvent] | None):
+    assert timed_line is not None
+    return timed_line[1].end
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+@dataclass
+class StageRecord:
+    name: str
+    start: float  # s, relative to the profiler creation
+    wall_time: float = 0.0  # s
+    cpu_time: float = 0.0  # s, process-wide (includes the torch worker threads)
+    peak_rss: int | None = None  # bytes, process peak at the end of the stage
+    thread_id: int = 0
+    tensors: dict[str, list[int]] = field(default_factory=dict)  # shapes
+
+    def tensor(self, name: str, tensor: torch.Tensor):
+        self.tensors[name] = list(tensor.shape)
+
+
+class _NullStage:
+    def tensor(self, name: str, tensor: torch.Tensor):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullProfiler:
+    """Profiler which records nothing"""
+
+    enabled = False
+
+    @contextmanager
+    def stage(self, name: str) -> Generator[StageRecord | _NullStage]:
+        yield _NULL_STAGE
+
+
+class Profiler(NullProfiler):
+    """Records the wall time, CPU time, peak RSS and tensor sizes of each stage"""
+
+    enabled = True
+
+    def __init__(self):
+        self.records: list[StageRecord] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Generator[StageRecord | _NullStage]:
+        record = StageRecord(
+            name,
+            start=time.perf_counter() - self._origin,
+            thread_id=threading.get_ident(),
+        )
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.cpu_time = time.process_time() - cpu_start
+            record.wall_time = time.perf_counter() - self._origin - record.start
+            record.peak_rss = _peak_rss()
+            with self._lock:
+                self.records.append(record)
+
+    def to_chrome_trace(self):
+        """Trace Event Format, to open in chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": record.name,
+                    "ph": "X",
+                    "ts": record.start * 1e6,
+                    "dur": record.wall_time * 1e6,
+                    "pid": pid,
+                    "tid": record.thread_id,
+                    "args": {
+                        "cpu_time": record.cpu_time,
+                        "peak_rss": record.peak_rss,
+                        **record.tensors,
+                    },
+                }
+                for record in self.records
+            ],
+            "displayTimeUnit": "ms",
+            "stages": [asdict(record) for record in self.records],
+        }
+
+    def save(self, path: Path):
+        path.write_text(json.dumps(self.to_chrome_trace(), indent=2))
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024  # KiB on Linux
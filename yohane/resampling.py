@@ -0,0 +1,20 @@
+from functools import lru_cache
+
+import torch
+from torchaudio.transforms import Resample
+
+
+@lru_cache(maxsize=32)
+def get_resampler(orig_freq: int, new_freq: int, device: torch.device) -> Resample:
+    """Resampling transform with its sinc kernel computed once per rate pair"""
+    return Resample(orig_freq, new_freq).to(device)
+
+
+def resample(waveform: torch.Tensor, orig_freq: int, new_freq: int):
+    """
+    Drop-in replacement for torchaudio.functional.resample which reuses the sinc
+    kernels. Like it, `waveform` itself is returned if the rates are the same.
+    """
+    if orig_freq == new_freq:
+        return waveform
+    return get_resampler(orig_freq, new_freq, waveform.device)(waveform)
@@ -0,0 +1,202 @@
+import logging
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+
+import torch
+from pysubs2 import SSAFile
+
+from yohane.batch import BatchJob, BatchResult
+from yohane.pipeline import Yohane
+
+logger = logging.getLogger(__name__)
+
+WriteFn = Callable[[Yohane, BatchJob, SSAFile], None]
+
+
+@dataclass
+class StageConfig:
+    workers: int = 1
+
+
+@dataclass
+class SchedulerConfig:
+    decode: StageConfig = field(default_factory=lambda: StageConfig(workers=2))
+    separate: StageConfig = field(default_factory=StageConfig)
+    align: StageConfig = field(default_factory=StageConfig)
+    write: StageConfig = field(default_factory=StageConfig)
+    queue_size: int = 1  # songs waiting between two stages
+    # torch intra-op threads, process-wide so shared by all the stages
+    threads: int | None = None
+
+
+@dataclass
+class _Item:
+    job: BatchJob
+    yohane: Yohane
+    subs: SSAFile | None = None
+    error: Exception | None = None
+
+
+_DONE = object()
+
+
+class PipelineScheduler:
+    """
+    Run songs through decode -> separate -> align -> write stages, each with its own
+    workers, so that song N+1 is separated while song N is aligned.
+
+    The workers share the models loaded by `yohane`. Bounded queues between the
+    stages keep the number of songs in memory in check.
+    """
+
+    def __init__(
+        self,
+        yohane: Yohane,
+        config: SchedulerConfig | None = None,
+        *,
+        write: WriteFn | None = None,
+    ):
+        self.yohane = yohane
+        self.config = config or SchedulerConfig()
+        self.write = write
+
+    def run(self, jobs: Iterable[BatchJob]) -> Iterator[BatchResult]:
+        """
+        Yield the results in completion order. A failing job is reported in its
+        `BatchResult` and does not stop the run.
+
+        `jobs` is consumed in a background thread, so a lazy iterable (e.g. which
+        downloads the songs) is overlapped with the other stages too.
+        """
+        config = self.config
+        stages: list[tuple[str, Callable[[_Item], None], StageConfig]] = [
+            ("decode", self._decode, config.decode),
+            ("separate", self._separate, config.separate),
+            ("align", self._align, config.align),
+            ("write", self._write, config.write),
+        ]
+        queues: list[queue.Queue] = [
+            queue.Queue(config.queue_size) for _ in range(len(stages))
+        ]
+        results: queue.Queue = queue.Queue()
+        queues.append(results)
+        stop = threading.Event()
+        feeder_errors: list[Exception] = []
+
+        def feed():
+            try:
+                for job in jobs:
+                    if not _put(queues[0], _Item(job, self.yohane.for_song()), stop):
+                        return
+            except Exception as e:
+                logger.exception("Failed to enumerate the jobs")
+                feeder_errors.append(e)
+            finally:
+                _put(queues[0], _DONE, stop)
+
+        threads = [threading.Thread(target=feed, name="feed", daemon=True)]
+        for i, (name, fn, stage_config) in enumerate(stages):
+            remaining = [stage_config.workers]
+            lock = threading.Lock()
+            for k in range(stage_config.workers):
+                worker = threading.Thread(
+                    target=self._work,
+                    args=(fn, queues[i], queues[i + 1]),
+                    kwargs={"stop": stop, "remaining": remaining, "lock": lock},
+                    name=f"{name}-{k}",
+                    daemon=True,
+                )
+                threads.append(worker)
+
+        # set once from the calling thread, before the workers start, and restored
+        # at the end since it is process-wide
+        previous_threads = torch.get_num_threads()
+        if config.threads is not None:
+            torch.set_num_threads(config.threads)
+        for thread in threads:
+            thread.start()
+        try:
+            while (item := results.get()) is not _DONE:
+                assert isinstance(item, _Item)
+                yield BatchResult(item.job, subs=item.subs, error=item.error)
+            if feeder_errors:
+                raise feeder_errors[0]
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            torch.set_num_threads(previous_threads)
+
+    def _work(
+        self,
+        fn: Callable[[_Item], None],
+        inbox: queue.Queue,
+        outbox: queue.Queue,
+        *,
+        stop: threading.Event,
+        remaining: list[int],
+        lock: threading.Lock,
+    ):
+        try:
+            while (item := _get(inbox, stop)) is not None:
+                if item is _DONE:
+                    _put(inbox, item, stop)  # wake up the other workers of the stage
+                    break
+                assert isinstance(item, _Item)
+                if item.error is None:
+                    try:
+                        fn(item)
+                    except Exception as e:
+                        logger.exception(f"Failed to process '{item.job.song_file}'")
+                        item.error = e
+                if item.error is not None:
+                    item.yohane.reset()  # release the waveforms as soon as possible
+                if not _put(outbox, item, stop):
+                    return
+        finally:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:  # last worker of the stage
+                    _put(outbox, _DONE, stop)
+
+    def _decode(self, item: _Item):
+        logger.info(f"Processing '{item.job.song_file.as_posix()}'")
+        if item.job.checkpoint_dir is not None:
+            item.yohane.resume_from(item.job.checkpoint_dir)
+        item.yohane.load_song(item.job.song_file)
+        item.yohane.load_lyrics(item.job.lyrics)
+
+    def _separate(self, item: _Item):
+        item.yohane.extract_vocals()
+
+    def _align(self, item: _Item):
+        item.yohane.force_align()
+        item.subs = item.yohane.make_subs()
+
+    def _write(self, item: _Item):
+        if self.write is not None:
+            assert item.subs is not None
+            with item.yohane.profiler.stage("encode"):
+                self.write(item.yohane, item.job, item.subs)
+        item.yohane.reset()
+
+
+def _put(q: queue.Queue, item: object, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
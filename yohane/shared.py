@@ -0,0 +1,151 @@
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from dataclasses import dataclass
+from multiprocessing import util
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from yohane.alignment import ForcedAlignment
+
+logger = logging.getLogger(__name__)
+
+# links held by this process, released when it exits (normally or not, as long as
+# the interpreter shuts down) so that nothing is left behind in /dev/shm
+_held: set[str] = set()
+_held_lock = threading.Lock()
+_finalizer_pid: int | None = None
+
+
+def _hold(path: str):
+    global _finalizer_pid
+    with _held_lock:
+        if _finalizer_pid != os.getpid():
+            # unlike atexit, multiprocessing finalizers also run in its children
+            util.Finalize(None, _release_held, exitpriority=0)
+            _finalizer_pid = os.getpid()
+        _held.add(path)
+
+
+def _unhold(paths: list[str]):
+    with _held_lock:
+        _held.difference_update(paths)
+
+
+def _release_held():
+    with _held_lock:
+        for path in _held:
+            logger.debug(f"Releasing shared tensor {path} at exit")
+            Path(path).unlink(missing_ok=True)
+        _held.clear()
+
+
+def _forget_held():
+    global _held_lock
+    # a forked child holds nothing of its parent, whose threads may hold the lock
+    _held_lock = threading.Lock()
+    _held.clear()
+
+
+os.register_at_fork(after_in_child=_forget_held)
+
+
+def default_shared_dir():
+    # tmpfs: the files are never written to a disk
+    shm = Path("/dev/shm")
+    return shm if shm.is_dir() else Path(tempfile.gettempdir())
+
+
+@dataclass(frozen=True)
+class SharedTensor:
+    """
+    Picklable handle to a tensor in a memory-mapped file, to hand it to another
+    process without copying it.
+
+    Each handle is a hard link to the file, so the links count the references:
+    `ref` makes a new one to send to another process, which `claim`s it, and
+    `release` drops it. The buffer is freed once the last link is removed and the
+    last view unmapped. The links a process holds, including the ones it sent but
+    which were not claimed yet, are released when it exits.
+    """
+
+    path: str
+    shape: tuple[int, ...]
+    dtype: str
+
+    @classmethod
+    def create(cls, tensor: torch.Tensor, directory: Path | None = None):
+        directory = directory if directory is not None else default_shared_dir()
+        array = tensor.detach().cpu().contiguous().numpy()
+        path = directory / f"yohane-{uuid.uuid4().hex}"
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        array.tofile(tmp_path)
+        os.replace(tmp_path, path)
+        _hold(path.as_posix())
+        return cls(path.as_posix(), tuple(array.shape), array.dtype.str)
+
+    def tensor(self) -> torch.Tensor:
+        """Copy-on-write view of the buffer"""
+        if 0 in self.shape:  # empty files cannot be mapped
+            return torch.from_numpy(np.empty(self.shape, self.dtype))
+        array = np.memmap(self.path, self.dtype, mode="c", shape=self.shape)
+        return torch.from_numpy(array)
+
+    def _link(self):
+        path = Path(self.path)
+        return path.with_name(f"{path.name.split('.')[0]}.{uuid.uuid4().hex[:8]}")
+
+    def ref(self):
+        link = self._link()
+        os.link(self.path, link)
+        # forget the links sent earlier which were claimed since
+        with _held_lock:
+            claimed = [path for path in _held if not os.path.exists(path)]
+        _unhold(claimed)
+        _hold(link.as_posix())
+        return SharedTensor(link.as_posix(), self.shape, self.dtype)
+
+    def claim(self):
+        """
+        Take over a handle sent by another process: it is renamed so that the
+        sender no longer releases it, and released by this process instead.
+        """
+        link = self._link()
+        os.rename(self.path, link)
+        _hold(link.as_posix())
+        return SharedTensor(link.as_posix(), self.shape, self.dtype)
+
+    def release(self):
+        _unhold([self.path])
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            logger.warning(f"Shared tensor {self.path} already released")
+
+
+@dataclass
+class SharedArtifacts:
+    """
+    Handles to the artifacts of a song, see `Yohane.share`. The digests are
+    carried along so that the receiving process does not hash the waveforms again.
+    """
+
+    song: tuple[SharedTensor, int] | None = None
+    song_digest: str | None = None
+    vocals: tuple[SharedTensor, int] | None = None
+    vocals_digest: str | None = None
+    forced_alignment: ForcedAlignment | None = None  # compact, pickled
+
+    def handles(self):
+        handles = [self.song[0] if self.song else None]
+        handles.append(self.vocals[0] if self.vocals else None)
+        return [handle for handle in handles if handle is not None]
+
+    def release(self):
+        """Drop the handles, e.g. if they could not be sent"""
+        for handle in self.handles():
+            handle.release()
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STATES = ["pending", "claimed", "done", "failed"]
+
+
+@dataclass
+class SpoolJob:
+    id: str
+    song: str  # file or URL, resolved by the worker
+    lyrics: str
+    output_dir: str | None = None
+    attempts: int = 0
+    worker: str | None = None
+    claim: str | None = None  # token of the current claim, in the claimed file name
+    error: str | None = None
+
+
+class Spool:
+    """
+    Directory-based job queue shared by several workers, e.g. on a network share.
+
+    Each job is a JSON file moved between the `pending`, `claimed`, `done` and
+    `failed` subdirectories with atomic renames, so a job is claimed by a single
+    worker without any lock or broker. A claimed job is named after a token of its
+    claim, so a worker whose job was taken back can neither renew nor finish the
+    claim of the next worker. The mtime of a claimed job is its lease: workers
+    renew it with heartbeats, and the jobs of the workers which stopped renewing it
+    for `lease` seconds are put back in the queue.
+
+    The lease must be longer than the clock skew between the machines.
+    """
+
+    def __init__(self, directory: Path, *, lease: float = 300.0, max_attempts: int = 3):
+        self.directory = directory
+        self.lease = lease
+        self.max_attempts = max_attempts
+        for state in STATES:
+            (directory / state).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state: str, job_id: str):
+        return self.directory / state / f"{job_id}.json"
+
+    def _claimed_path(self, job: SpoolJob):
+        assert job.claim is not None
+        return self._path("claimed", f"{job.id}.{job.claim}")
+
+    def _ids(self, state: str):
+        # temporary files are hidden
+        names = os.listdir(self.directory / state)
+        return sorted(n[:-5] for n in names if n.endswith(".json") and n[0] != ".")
+
+    def _read(self, path: Path):
+        return SpoolJob(**json.loads(path.read_text()))
+
+    def _write(self, path: Path, job: SpoolJob):
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(asdict(job)))
+        os.replace(tmp_path, path)
+
+    def enqueue(self, song: str, lyrics: str, output_dir: str | None = None):
+        # FIFO: the ids sort by enqueue time
+        job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        job = SpoolJob(job_id, song, lyrics, output_dir)
+        self._write(self._path("pending", job_id), job)
+        return job
+
+    def claim(self, worker: str) -> SpoolJob | None:
+        """Take the oldest pending job, or None if there is none"""
+        self.recover_expired()
+        for job_id in self._ids("pending"):
+            pending_path = self._path("pending", job_id)
+            claim = uuid.uuid4().hex[:12]
+            claimed_path = self._path("claimed", f"{job_id}.{claim}")
+            try:
+                # start the lease before the rename: a claimed job is never stale
+                os.utime(pending_path)
+                os.rename(pending_path, claimed_path)
+            except FileNotFoundError:
+                continue  # claimed by another worker
+            job = self._read(claimed_path)
+            job.worker = worker
+            job.claim = claim
+            self._write(claimed_path, job)
+            logger.info(f"{worker} claimed job {job_id} ('{job.song}')")
+            return job
+        return None
+
+    def heartbeat(self, job: SpoolJob):
+        """Renew the lease, return False if it was lost"""
+        try:
+            os.utime(self._claimed_path(job))
+        except FileNotFoundError:
+            return False
+        return True
+
+    @contextmanager
+    def keep_alive(self, job: SpoolJob) -> Generator[threading.Event]:
+        """Renew the lease in the background, the event is set if it was lost"""
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease / 3):
+                if not self.heartbeat(job):
+                    logger.warning(f"Lost the lease of job {job.id}")
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{job.id}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, job: SpoolJob):
+        job.error = None
+        return self._finish(job, "done")
+
+    def fail(self, job: SpoolJob, error: str):
+        """Put the job back in the queue, or in `failed` after `max_attempts`"""
+        job.attempts += 1
+        job.error = error
+        if job.attempts < self.max_attempts:
+            logger.info(f"Job {job.id} failed, retrying ({job.attempts=})")
+            return self._finish(job, "pending")
+        logger.error(f"Job {job.id} failed {job.attempts} times, giving up")
+        return self._finish(job, "failed")
+
+    def release(self, job: SpoolJob):
+        """Put the job back in the queue without counting an attempt"""
+        return self._finish(job, "pending")
+
+    def _finish(self, job: SpoolJob, state: str):
+        claimed_path = self._claimed_path(job)
+        try:
+            # move it out of `claimed` first so that it cannot expire meanwhile
+            tmp_path = self.directory / state / f".{claimed_path.name}.tmp"
+            os.rename(claimed_path, tmp_path)
+        except FileNotFoundError:
+            logger.warning(f"Job {job.id} was taken back after its lease expired")
+            return False
+        job.claim = None
+        tmp_path.write_text(json.dumps(asdict(job)))
+        os.replace(tmp_path, self._path(state, job.id))
+        return True
+
+    def recover_expired(self):
+        """Put back the claimed jobs whose lease expired (the worker died)"""
+        now = time.time()
+        for name in self._ids("claimed"):
+            job_id, _, claim = name.partition(".")
+            claimed_path = self._path("claimed", name)
+            try:
+                expired = now - claimed_path.stat().st_mtime > self.lease
+                if not expired:
+                    continue
+                job = self._read(claimed_path)
+            except (OSError, ValueError):
+                continue
+            job.claim = claim  # the file name is authoritative
+            logger.warning(f"Lease of job {job_id} expired ({job.worker=})")
+            self.fail(job, f"lease expired ({job.worker})")
+
+    def counts(self):
+        return {state: len(self._ids(state)) for state in STATES}
+
+
+def work(
+    spool: Spool,
+    worker: str,
+    process: Callable[[SpoolJob], None],
+    *,
+    poll_interval: float = 10.0,
+    exit_when_empty: bool = False,
+):
+    """
+    Process the jobs of the spool until interrupted (or until the queue is empty
+    with `exit_when_empty`). A job is failed if `process` raises.
+    """
+    while True:
+        job = spool.claim(worker)
+        if job is None:
+            if exit_when_empty and not spool.counts()["claimed"]:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        with spool.keep_alive(job) as lost:
+            try:
+                process(job)
+            except KeyboardInterrupt:
+                spool.release(job)
+                raise
+            except Exception as e:
+                logger.exception(f"Failed to process job {job.id}")
+                error = f"{type(e).__name__}: {e}"
+            else:
+                error = None
+        if lost.is_set():
+            continue  # another worker has it now
+        if error is None:
+            spool.complete(job)
+        else:
+            spool.fail(job, error)
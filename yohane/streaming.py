@@ -0,0 +1,81 @@
+import logging
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import torch
+from torchcodec.decoders._audio_decoder import AudioDecoder
+
+from yohane.audio import Separator
+from yohane.resampling import resample
+
+logger = logging.getLogger(__name__)
+
+
+def iter_song_blocks(
+    song_file: Path, block_length: float
+) -> Iterator[tuple[torch.Tensor, int]]:
+    """Decode the song in consecutive blocks of `block_length` seconds"""
+    decoder = AudioDecoder(song_file.as_posix())
+    sample_rate = decoder.metadata.sample_rate
+    assert sample_rate is not None
+    block_samples = round(block_length * sample_rate)
+    i = 0
+    while True:
+        start = i * block_samples / sample_rate
+        samples = decoder.get_samples_played_in_range(
+            start, start + block_samples / sample_rate
+        )
+        waveform = samples.data
+        if waveform.size(1) == 0:
+            break
+        if waveform.size(0) > 2:
+            waveform = waveform.mean(dim=0, keepdim=True).repeat(2, 1)
+        yield waveform, samples.sample_rate
+        if waveform.size(1) < block_samples:  # last block
+            break
+        i += 1
+
+
+def iter_separated_blocks(
+    separator: Separator,
+    blocks: Iterable[tuple[torch.Tensor, int]],
+    context: float = 5.0,
+) -> Iterator[tuple[torch.Tensor, torch.Tensor, int]]:
+    """
+    Separate the vocals of each song block, yielding (vocals, off_vocal, sample_rate)
+    blocks at the song sample rate.
+
+    Each block is separated along with `context` seconds of its neighbours, which
+    are cropped from the result to avoid artifacts at the block boundaries.
+    """
+    previous: torch.Tensor | None = None
+    current: tuple[torch.Tensor, int] | None = None
+    for block in blocks:
+        if current is not None:
+            yield _separate_block(separator, previous, *current, block[0], context)
+            previous = current[0]
+        current = block
+    if current is not None:
+        yield _separate_block(separator, previous, *current, None, context)
+
+
+def _separate_block(
+    separator: Separator,
+    previous: torch.Tensor | None,
+    waveform: torch.Tensor,
+    sample_rate: int,
+    following: torch.Tensor | None,
+    context: float,
+):
+    context_samples = round(context * sample_rate)
+    left = previous[:, -context_samples:] if previous is not None else waveform[:, :0]
+    right = following[:, :context_samples] if following is not None else waveform[:, :0]
+    mix = torch.cat((left, waveform, right), dim=1)
+
+    vocals, vocals_sample_rate = separator(mix, sample_rate)
+    vocals = resample(vocals.cpu(), vocals_sample_rate, sample_rate)
+    vocals = vocals[:, left.size(1) : left.size(1) + waveform.size(1)]
+    if vocals.size(1) < waveform.size(1):
+        vocals = torch.nn.functional.pad(vocals, (0, waveform.size(1) - vocals.size(1)))
+
+    return vocals, waveform - vocals, sample_rate
@@ -1,12 +1,13 @@
 from dataclasses import dataclass
-from functools import partial
+from itertools import pairwise
 
+import torch
 from pysubs2 import SSAEvent, SSAFile
 from torch import Tensor
-from torchaudio.functional import TokenSpan
 
-from yohane.audio import TokenizerFn
+from yohane.alignment import ForcedAlignment
 from yohane.lyrics import Lyrics
+from yohane.tokens import TokenPlan
 from yohane.utils import get_identifier
 
 
@@ -21,57 +22,51 @@ class TimedSyllable:
         return round(k_s * 100)  # cs
 
 
-def make_ass(
-    lyrics: Lyrics,
-    waveform: Tensor,
-    sample_rate: int,
-    tokenizer: TokenizerFn,
-    emission: Tensor,
-    token_spans: list[list[TokenSpan]],
-):
-    all_line_syllables = time_lyrics(
-        lyrics,
-        waveform,
-        sample_rate,
-        tokenizer,
-        emission,
-        token_spans,
-    )
+@dataclass
+class SyllableTimings:
+    """Columnar timing of all the syllables of some lyrics"""
+
+    values: list[str]
+    starts: Tensor  # s
+    ends: Tensor  # s
+    k_durations: Tensor  # cs, snapped to the start of the next syllable of the line
+    spaced: Tensor  # last syllable of a word, followed by another word in the line
+    line_offsets: Tensor  # index of the first syllable of each line, and the end
+
+    def lines(self):
+        """`TimedSyllable`s of each line, with None between the words"""
+        starts = self.starts.tolist()
+        ends = self.ends.tolist()
+        spaced = self.spaced.tolist()
+        all_line_syllables: list[list[TimedSyllable | None]] = []
+        for a, b in pairwise(self.line_offsets.tolist()):
+            line_syllables: list[TimedSyllable | None] = []
+            for i in range(a, b):
+                line_syllables.append(TimedSyllable(self.values[i], starts[i], ends[i]))
+                if spaced[i]:
+                    line_syllables.append(None)
+            all_line_syllables.append(line_syllables)
+        return all_line_syllables
+
+
+def make_ass(lyrics: Lyrics, token_plan: TokenPlan, alignment: ForcedAlignment):
+    timings = time_syllables(lyrics, token_plan, alignment)
 
     subs = SSAFile()
     subs.info["Original Timing"] = get_identifier()
 
-    for line, syllables in zip(lyrics.lines, all_line_syllables):
-        start_syl = syllables[0]
-        end_syl = syllables[-1]
-        assert start_syl is not None and end_syl is not None
-
-        event = SSAEvent(round(start_syl.start_s * 1000), round(end_syl.end_s * 1000))
-
-        for i, syllable in enumerate(syllables):
-            if syllable is None:  # space
-                continue
-
-            value = syllable.value
-
-            snap_to_i = None
-            if i < len(syllables) - 1:  # not last syllable in line
-                if syllables[i + 1] is None:  # next is space
-                    value += " "
-                    snap_to_i = i + 2  # snap to syllable after the space
-                else:
-                    snap_to_i = i + 1  # snap to next syllable
-
-            if snap_to_i is not None:
-                snap_to_syl = syllables[snap_to_i]
-                assert snap_to_syl is not None
-                snap_to = snap_to_syl.start_s
-            else:
-                snap_to = None
-
-            k_duration = syllable.k_duration(snap_to=snap_to)  # cs
-            event.text += rf"{{\k{k_duration}}}{value}"
-
+    karaoke = [
+        rf"{{\k{k_duration}}}{value} " if spaced else rf"{{\k{k_duration}}}{value}"
+        for value, k_duration, spaced in zip(
+            timings.values, timings.k_durations.tolist(), timings.spaced.tolist()
+        )
+    ]
+    starts = torch.round(timings.starts * 1000).long().tolist()  # ms
+    ends = torch.round(timings.ends * 1000).long().tolist()  # ms
+
+    for line, (a, b) in zip(lyrics.lines, pairwise(timings.line_offsets.tolist())):
+        assert a < b, "line without syllables"
+        event = SSAEvent(starts[a], ends[b - 1], "".join(karaoke[a:b]))
         # save the raw line in a comment
         comment = SSAEvent(event.start, event.end, line.raw, type="Comment")
         subs.extend((comment, event))
@@ -79,67 +74,68 @@ def make_ass(
     return subs
 
 
-def time_lyrics(
-    lyrics: Lyrics,
-    waveform: Tensor,
-    sample_rate: int,
-    tokenizer: TokenizerFn,
-    emission: Tensor,
-    token_spans: list[list[TokenSpan]],
-):
-    # audio processing parameters
-    num_frames = emission.size(1)
-    ratio = waveform.size(1) / num_frames
-
-    token_spans_iter = iter(token_spans)
-    add_syllable = partial(_time_syllable, ratio, sample_rate, tokenizer)
-
-    all_line_syllables: list[list[TimedSyllable | None]] = []
-
-    for line in lyrics.lines:
-        line_syllables: list[TimedSyllable | None] = []
-
-        for word in line.words:
-            spans = next(token_spans_iter)
-            span_idx = 0
-            time_syllable = partial(add_syllable, spans)
-
-            for syllable in word.syllables:
-                nb_tokens, timed_syllable = time_syllable(syllable, span_idx)
-                span_idx += nb_tokens
-                line_syllables.append(timed_syllable)
-
-            line_syllables.append(None)
-
-        line_syllables = line_syllables[:-1]  # remove trailing None
-        all_line_syllables.append(line_syllables)
-
-    try:
-        next(token_spans_iter)  # make sure we used all spans
-        raise RuntimeError("not all spans were used")
-    except StopIteration:
-        pass
-
-    return all_line_syllables
-
-
-def _time_syllable(
-    ratio: float,
-    sample_rate: float,
-    tokenizer: TokenizerFn,
-    spans: list[TokenSpan],
-    syllable: str,
-    span_idx: int,
-):
-    syllable_tokens = tokenizer([syllable])
-    nb_tokens = len(syllable_tokens[0])
-
-    # start and end time of syllable
-    x0 = ratio * spans[span_idx].start
-    x1 = ratio * spans[span_idx + nb_tokens - 1].end
-    t_start = x0 / sample_rate  # s
-    t_end = x1 / sample_rate  # s
+def read_timed_lines(subs: SSAFile):
+    """Pair the raw line comments with their timed events, as written by make_ass"""
+    timed_lines: list[tuple[SSAEvent, SSAEvent]] = []
+    comment = None
+    for event in subs.events:
+        if event.is_comment:
+            comment = event
+        elif comment is not None:
+            timed_lines.append((comment, event))
+            comment = None
+    return timed_lines
+
+
+def time_lyrics(lyrics: Lyrics, token_plan: TokenPlan, alignment: ForcedAlignment):
+    return time_syllables(lyrics, token_plan, alignment).lines()
+
+
+def time_syllables(
+    lyrics: Lyrics, token_plan: TokenPlan, alignment: ForcedAlignment
+) -> SyllableTimings:
+    words = [word for line in lyrics.lines for word in line.words]
+    values = [syllable for word in words for syllable in word.syllables]
+    counts = token_plan.syllable_counts
+    syllable_offsets = token_plan.syllable_offsets
+    if alignment.span_counts.size(0) != syllable_offsets.size(0) - 1:
+        raise RuntimeError("the spans do not match the words")
+
+    # word of each syllable
+    syllable_words = torch.repeat_interleave(
+        torch.arange(syllable_offsets.size(0) - 1), syllable_offsets.diff()
+    )
+    # first and last span of each syllable, among the spans of its word
+    token_offsets = _offsets(counts)
+    span_offsets = _offsets(alignment.span_counts.long())
+    word_first_tokens = token_offsets[syllable_offsets[:-1]][syllable_words]
+    first = span_offsets[syllable_words] + token_offsets[:-1] - word_first_tokens
+    last = first + counts - 1
+    if (last >= span_offsets[syllable_words + 1]).any():
+        raise RuntimeError("not enough spans for the syllables of a word")
+
+    ratio = alignment.frame_ratio
+    starts = alignment.starts.double()[first] * ratio / alignment.sample_rate  # s
+    ends = alignment.ends.double()[last] * ratio / alignment.sample_rate  # s
+
+    word_ends = torch.zeros(len(values), dtype=torch.bool)
+    word_ends[syllable_offsets[1:][syllable_offsets.diff() > 0] - 1] = True
+    line_offsets = syllable_offsets[
+        _offsets(
+            torch.tensor([len(line.words) for line in lyrics.lines], dtype=torch.int64)
+        )
+    ]
+    line_ends = torch.zeros(len(values), dtype=torch.bool)
+    line_ends[line_offsets[1:][line_offsets.diff() > 0] - 1] = True
+
+    # a syllable lasts until the next one starts, the last of the line until its end
+    snap_to = torch.where(line_ends, ends, starts.roll(-1))
+    k_durations = torch.round((snap_to - starts) * 100).long()  # cs
+
+    return SyllableTimings(
+        values, starts, ends, k_durations, word_ends & ~line_ends, line_offsets
+    )
 
-    timed_syllable = TimedSyllable(syllable, t_start, t_end)
 
-    return nb_tokens, timed_syllable
+def _offsets(counts: Tensor):
+    return torch.cat([counts.new_zeros(1), counts.cumsum(0)])
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import pairwise
+
+import torch
+
+from yohane.audio import ForcedAligner, TokenizerFn
+from yohane.lyrics import Lyrics
+
+MAX_CACHED_PLANS = 64
+
+
+@dataclass(frozen=True)
+class TokenPlan:
+    """
+    Tokenization of some lyrics, computed once and shared between the forced
+    alignment (tokens of each word) and the timing (tokens of each syllable).
+    """
+
+    token_ids: torch.Tensor  # all the tokens of the lyrics
+    word_offsets: torch.Tensor  # index of the first token of each word, and the end
+    syllable_counts: torch.Tensor  # number of tokens of each syllable
+    # index of the first syllable of each word, and the end
+    syllable_offsets: torch.Tensor
+
+    @classmethod
+    def from_lyrics(cls, lyrics: Lyrics, aligner: ForcedAligner):
+        # keyed on the identity and not on the aligner, so that the cache does not
+        # keep the models alive
+        key = (lyrics.raw, aligner.identity)
+        with _plans_lock:
+            if (plan := _plans.get(key)) is not None:
+                _plans.move_to_end(key)
+                return plan
+        plan = _make_token_plan(lyrics.raw, aligner.tokenize)
+        with _plans_lock:
+            _plans[key] = plan
+            while len(_plans) > MAX_CACHED_PLANS:
+                _plans.popitem(last=False)
+        return plan
+
+    @property
+    def num_words(self):
+        return self.word_offsets.size(0) - 1
+
+    @property
+    def tokens(self) -> list[list[int]]:
+        """Tokens of each word"""
+        offsets = self.word_offsets.tolist()
+        token_ids = self.token_ids.tolist()
+        return [token_ids[start:end] for start, end in pairwise(offsets)]
+
+
+_plans: OrderedDict[tuple[str, str], TokenPlan] = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def _make_token_plan(lyrics_raw: str, tokenizer: TokenizerFn):
+    lyrics = Lyrics(lyrics_raw)
+    word_tokens = tokenizer(lyrics.transcript)
+    words = [word for line in lyrics.lines for word in line.words]
+    syllables = [syllable for word in words for syllable in word.syllables]
+    syllable_tokens = tokenizer(syllables) if syllables else []
+
+    def offsets(lengths: list[int]):
+        return torch.tensor([0, *lengths], dtype=torch.int64).cumsum(0)
+
+    return TokenPlan(
+        token_ids=torch.tensor(
+            [token for tokens in word_tokens for token in tokens], dtype=torch.int64
+        ),
+        word_offsets=offsets([len(tokens) for tokens in word_tokens]),
+        syllable_counts=torch.tensor(
+            [len(tokens) for tokens in syllable_tokens], dtype=torch.int64
+        ),
+        syllable_offsets=offsets([len(word.syllables) for word in words]),
+    )